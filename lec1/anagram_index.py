@@ -0,0 +1,342 @@
+#words.txtから作る(ソート済み単語, 単語)の辞書をファイルに保存して使い回す
+#ファイルはmmapで開くので起動時に84k語を読み直さなくてよい
+#words.txtの更新時刻とサイズを覚えておき，変わっていたら作り直す
+#
+#ファイル形式
+#  ヘッダ: MAGIC, words.txtのmtime(ns), words.txtのサイズ, ペアの数
+#  オフセット表: ペアの数+1 個のuint32（データ部の先頭からの位置）
+#  データ部: "sorted_word\tword\n" をsorted_word順に並べたもの
+#
+#単語の追加・削除はIncrementalIndexで行う。変更は追記だけの変更ログ(words.txt.idx.log)に
+#書いておき，compact()でwords.txtとインデックスファイルに書き戻す
+#
+#SignatureIndex（文字の個数の署名 -> 単語）は作るのに時間がかかるので，pickleにして
+#words.txt.idx.sig に保存しておき，インデックスと同じ目印で使えるか確かめる
+
+import mmap
+import os
+import pickle
+import struct
+
+WORDS_FILE = "words.txt"
+MAGIC = b"ANAGIDX1"
+HEADER = struct.Struct("<8sqqI")
+OFFSET = struct.Struct("<I")
+
+
+def sort_word(word): #入力文字列のソート
+    return ''.join(sorted(word))
+
+def sort_dictionary(dictionary):
+    return sorted(dictionary, key=lambda x: x[0]) #key=lamdaでソート基準を指定。それは要素xの0番目
+
+def create_new_dictionary(dictionary):
+    new_dictionary = [] #配列を定義
+    for word in dictionary:
+        new_dictionary.append((sort_word(word), word)) #並べ替えしたwordとwordのペアを新しい辞書に入れる
+    return new_dictionary
+
+
+#各文字の個数を並べた26バイトの署名。ソートせずにO(k)で作れる
+#a-z以外の文字が入っていたら辞書のどの単語とも一致しないのでNone
+def count_signature(word):
+    count = [0] * 26
+    for character in word:
+        i = ord(character) - ord('a')
+        if not 0 <= i < 26:
+            return None
+        count[i] += 1
+    return bytes(count)
+
+
+def binary_search(sorted_word, dictionary): #act, (act, cat)
+    left = 0
+    right = len(dictionary) - 1
+    anagram_list = []
+
+
+    while left <= right:
+        mid = (left + right) // 2
+        if dictionary[mid][0] == sorted_word:
+            while mid > 0 and dictionary[mid-1][0] == sorted_word:
+                mid -= 1
+            while mid < len(dictionary) and dictionary[mid][0] == sorted_word:
+                anagram_list.append(dictionary[mid][1])
+                mid += 1
+            return anagram_list  # 元の単語を返す
+        elif dictionary[mid][0] < sorted_word:
+            left = mid + 1
+        else:
+            right = mid - 1
+    return []  # 見つからなかった場合
+
+
+def index_path_for(words_path):
+    return words_path + ".idx"
+
+
+def source_stamp(words_path): #words.txtが変わったかどうかの目印
+    stat = os.stat(words_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def write_index(sorted_dictionary, index_path, stamp):
+    data = bytearray()
+    offsets = []
+    for sorted_word, word in sorted_dictionary:
+        offsets.append(len(data))
+        data += f"{sorted_word}\t{word}\n".encode('utf-8')
+    offsets.append(len(data))
+
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, stamp[0], stamp[1], len(sorted_dictionary)))
+        file.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        file.write(data)
+    os.replace(tmp_path, index_path) #書きかけのファイルを読まれないように最後に置き換える
+
+
+def build_index(words_path, index_path):
+    stamp = source_stamp(words_path)
+    with open(words_path, 'r', encoding='utf-8') as file:
+        words_data = [line.strip() for line in file]
+    new_dictionary = create_new_dictionary(words_data)
+    write_index(sort_dictionary(new_dictionary), index_path, stamp)
+
+
+class AnagramIndex:
+    #sort_dictionaryの結果と同じように (sorted_word, word) の列として使える
+    #lec1-1.pyのbinary_searchにそのまま渡せる
+
+    def __init__(self, index_path):
+        self.file = open(index_path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: #空ファイルはmmapできない
+            self.file.close()
+            raise ValueError(f"{index_path} is not an anagram index")
+        if len(self.data) < HEADER.size:
+            self.close()
+            raise ValueError(f"{index_path} is not an anagram index")
+        magic, mtime, size, self.count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{index_path} is not an anagram index")
+        self.stamp = (mtime, size)
+        self.data_start = HEADER.size + OFFSET.size * (self.count + 1)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        start = OFFSET.unpack_from(self.data, HEADER.size + OFFSET.size * i)[0]
+        end = OFFSET.unpack_from(self.data, HEADER.size + OFFSET.size * (i + 1))[0]
+        record = self.data[self.data_start + start:self.data_start + end - 1] #最後の\nは除く
+        sorted_word, word = record.decode('utf-8').split('\t')
+        return (sorted_word, word)
+
+    def pairs(self): #全部の(sorted_word, word)をまとめて読む
+        records = self.data[self.data_start:].decode('utf-8').split('\n')[:-1]
+        return [tuple(record.split('\t')) for record in records]
+
+    def words(self): #ソート済み単語の順に全単語を返す
+        return [word for _, word in self.pairs()]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_index(words_path=WORDS_FILE, index_path=None):
+    #インデックスが無い・壊れている・words.txtが変わった場合だけ作り直す
+    if index_path is None:
+        index_path = index_path_for(words_path)
+    stamp = source_stamp(words_path)
+    if os.path.exists(index_path):
+        try:
+            index = AnagramIndex(index_path)
+        except ValueError:
+            index = None
+        if index is not None:
+            if index.stamp == stamp:
+                return index
+            index.close()
+    build_index(words_path, index_path)
+    return AnagramIndex(index_path)
+
+
+class IncrementalIndex:
+    #保存済みのインデックスの上に，追加・削除した単語を重ねて見せる
+    #変更は1行ずつ "+word" / "-word" として変更ログに追記し，次に開いたときに読み直す
+    #compact()で変更をwords.txtとインデックスファイルに反映してログを空にする
+
+    def __init__(self, words_path=WORDS_FILE, index_path=None):
+        if index_path is None:
+            index_path = index_path_for(words_path)
+        self.words_path = words_path
+        self.index_path = index_path
+        self.log_path = index_path + ".log"
+        self.base = load_index(words_path, index_path)
+        self.added = {} #sorted_word -> 追加した単語のリスト
+        self.removed = set() #baseから消した単語
+        if os.path.exists(self.log_path):
+            #同じ変更を二回当てても結果は変わらないので，途中で落ちても読み直せばよい
+            with open(self.log_path, 'r', encoding='utf-8') as log:
+                for line in log:
+                    line = line.rstrip('\n')
+                    if line.startswith('+'):
+                        self.apply_add(line[1:])
+                    elif line.startswith('-'):
+                        self.apply_remove(line[1:])
+        self.log = open(self.log_path, 'a', encoding='utf-8')
+
+    def find(self, word): #wordのanagramのリスト
+        sorted_word = sort_word(word)
+        anagram_list = [w for w in binary_search(sorted_word, self.base) if w not in self.removed]
+        return anagram_list + self.added.get(sorted_word, [])
+
+    def __contains__(self, word):
+        return word in self.find(word)
+
+    def apply_add(self, word):
+        if word in self:
+            return False
+        if word in self.removed:
+            self.removed.discard(word)
+        else:
+            self.added.setdefault(sort_word(word), []).append(word)
+        return True
+
+    def apply_remove(self, word):
+        if word not in self:
+            return False
+        added = self.added.get(sort_word(word), [])
+        if word in added:
+            added.remove(word)
+        else:
+            self.removed.add(word)
+        return True
+
+    def add_word(self, word):
+        if not self.apply_add(word):
+            return False
+        self.log.write(f"+{word}\n")
+        self.log.flush()
+        return True
+
+    def remove_word(self, word):
+        if not self.apply_remove(word):
+            return False
+        self.log.write(f"-{word}\n")
+        self.log.flush()
+        return True
+
+    def pending_changes(self):
+        return len(self.removed) + sum(len(words) for words in self.added.values())
+
+    def pairs(self):
+        pairs = [pair for pair in self.base.pairs() if pair[1] not in self.removed]
+        for sorted_word, words in self.added.items():
+            pairs.extend((sorted_word, word) for word in words)
+        return sort_dictionary(pairs)
+
+    def words(self):
+        return [word for _, word in self.pairs()]
+
+    def compact(self):
+        #1. words.txt: 消した単語を除き，追加した単語を最後に足す
+        with open(self.words_path, 'r', encoding='utf-8') as file:
+            words_data = [line.strip() for line in file]
+        words_data = [word for word in words_data if word not in self.removed]
+        for words in self.added.values():
+            words_data.extend(words)
+        tmp_path = self.words_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            for word in words_data:
+                file.write(f"{word}\n")
+        os.replace(tmp_path, self.words_path)
+
+        #2. 新しいwords.txtの目印でインデックスを書き直す
+        #  self.pairs()は開いたときのインデックスが元なので，その後でwords.txtが変わっていると古い。
+        #  いま書いたwords_dataから作る
+        pairs = sort_dictionary(create_new_dictionary(words_data))
+        self.base.close()
+        write_index(pairs, self.index_path, source_stamp(self.words_path))
+        self.base = AnagramIndex(self.index_path)
+
+        #3. 反映済みの変更ログを空にする
+        self.log.close()
+        self.log = open(self.log_path, 'w', encoding='utf-8')
+        self.added = {}
+        self.removed = set()
+
+    def close(self):
+        self.log.close()
+        self.base.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SignatureIndex:
+    #署名 -> self.words の中の連続した範囲 [start, end) のハッシュ表
+    #同じ文字の組み合わせの単語はまとめて並べておく
+    #wordsがAnagramIndex.words()のように同じ組み合わせごとに並んでいれば順番はそのまま
+
+    #rangesを渡したときはwordsがすでにそのrangesの順に並んでいるものとして，そのまま使う
+    def __init__(self, words, ranges=None):
+        if ranges is not None:
+            self.words = words
+            self.ranges = ranges
+            return
+        groups = {}
+        for word in words:
+            signature = count_signature(word)
+            if signature is not None:
+                groups.setdefault(signature, []).append(word)
+        self.words = []
+        self.ranges = {}
+        for signature, group in groups.items():
+            self.ranges[signature] = (len(self.words), len(self.words) + len(group))
+            self.words.extend(group)
+
+    def find(self, word):
+        word_range = self.ranges.get(count_signature(word))
+        if word_range is None:
+            return []
+        return self.words[word_range[0]:word_range[1]]
+
+
+#保存済みの署名のハッシュ表を読む。なければ作って保存する
+#インデックスの目印が違うときや，変更ログにまだ反映していない変更があるときは作り直す（保存しない）
+def load_signature_index(index):
+    signature_path = index.index_path + ".sig"
+    if index.pending_changes():
+        return SignatureIndex(index.words())
+    stamp = index.base.stamp
+    if os.path.exists(signature_path):
+        try:
+            with open(signature_path, 'rb') as file:
+                saved_stamp, words, ranges = pickle.load(file)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            saved_stamp = None
+        if saved_stamp == stamp:
+            return SignatureIndex(words, ranges)
+    signature_index = SignatureIndex(index.words())
+    tmp_path = signature_path + ".tmp"
+    with open(tmp_path, 'wb') as file:
+        pickle.dump((stamp, signature_index.words, signature_index.ranges), file,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, signature_path)
+    return signature_index
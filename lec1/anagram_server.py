@@ -0,0 +1,123 @@
+#インデックスを一度だけ開いて，たくさんのクエリに答え続けるサーバー
+#lec1-1.py --server から使う
+#
+#プロトコル: 1行に1リクエスト。空白区切りで複数の単語を送るとまとめて答える
+#  > act cat dog
+#  < {"act": ["act", "cat"], "cat": ["act", "cat"], "dog": ["dog", "god"]}
+#  > !stats
+#  < {"queries": 3, "cache_hits": 1, ...}
+#  > !add wordz      (!remove, !compact も同じ。IncrementalIndexを渡したときだけ)
+#  < {"add": [true], "pending_changes": 1}
+#標準入力と，Unixドメインソケットのどちらでも同じやり方で話せる
+
+import collections
+import json
+import os
+import socketserver
+import stat
+import sys
+import threading
+import time
+
+CACHE_SIZE = 4096
+
+
+class AnagramServer:
+    #lookup(word)はwordのanagramのリストを返す関数
+    #indexはadd_word/remove_word/compactを持つもの（anagram_index.IncrementalIndex）
+    def __init__(self, lookup, cache_size=CACHE_SIZE, index=None):
+        self.lookup = lookup
+        self.index = index
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict() #最近使った順に並べたLRUキャッシュ
+        self.lock = threading.Lock()
+        self.index_lock = threading.Lock() #更新中(特にcompact中)は引かない。lockと両方取るときはindex_lockが先
+        self.queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def query(self, word):
+        begin = time.perf_counter()
+        with self.lock:
+            result = self.cache.get(word)
+            if result is not None:
+                self.cache.move_to_end(word)
+                self.cache_hits += 1
+        if result is None:
+            #キャッシュに入れ終わるまでindex_lockを持っておく
+            #（離してから入れると，その間の更新で消したキャッシュに古い答えを入れてしまう）
+            with self.index_lock:
+                result = self.lookup(word)
+                with self.lock:
+                    self.cache_misses += 1
+                    self.cache[word] = result
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False) #一番古いものを捨てる
+        latency = time.perf_counter() - begin
+        with self.lock:
+            self.queries += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queries': self.queries,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'cache_entries': len(self.cache),
+                'avg_latency_us': self.total_latency / self.queries * 1e6 if self.queries else 0.0,
+                'max_latency_us': self.max_latency * 1e6,
+            }
+
+    def update(self, command, words):
+        if self.index is None:
+            return {'error': 'this server does not accept updates'}
+        result = {}
+        with self.index_lock:
+            if command == '!add':
+                result['add'] = [self.index.add_word(word) for word in words]
+            elif command == '!remove':
+                result['remove'] = [self.index.remove_word(word) for word in words]
+            else:
+                self.index.compact()
+            result['pending_changes'] = self.index.pending_changes()
+            with self.lock:
+                self.cache.clear() #古い答えが残らないように全部捨てる
+        return result
+
+    #1行のリクエストに対する1行の返事（改行なし）
+    def handle_line(self, line):
+        line = line.strip()
+        if line == '!stats':
+            return json.dumps(self.stats())
+        command, *words = line.split() or ['']
+        if command in ('!add', '!remove', '!compact'):
+            return json.dumps(self.update(command, words))
+        return json.dumps({word: self.query(word) for word in line.split()})
+
+    def serve_stdin(self, input_file=sys.stdin, output_file=sys.stdout):
+        for line in input_file:
+            output_file.write(self.handle_line(line) + '\n')
+            output_file.flush()
+
+    def serve_unix_socket(self, path):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    self.wfile.write((server.handle_line(line.decode('utf-8')) + '\n').encode('utf-8'))
+
+        if os.path.exists(path): #前回残ったソケットだけ消す（--socket words.txt で辞書を消さないように）
+            if not stat.S_ISSOCK(os.stat(path).st_mode):
+                raise FileExistsError(f"{path} already exists and is not a socket")
+            os.remove(path)
+        with socketserver.ThreadingUnixStreamServer(path, Handler) as unix_server:
+            try:
+                unix_server.serve_forever()
+            finally:
+                os.remove(path)
@@ -0,0 +1,166 @@
+#lec1の解答プログラムのベンチマーク
+#
+# $ python3 benchmark.py engines                  # lec1-2.pyのエンジンを同じプロセス内で比較
+# $ python3 benchmark.py engines --engines score trie numpy --files large.txt
+# $ python3 benchmark.py suite                    # lec1-1とlec1-2を別プロセスで実行して測る
+# $ python3 benchmark.py suite --synthetic 100000 1000000 --save-baseline base.json
+# $ python3 benchmark.py suite --baseline base.json    # 保存したbaselineと比べる
+#
+#engines: 辞書の前処理と入力単語の処理の時間を別々に測り，答えがエンジン間で一致するかも確かめる
+#suite:   lec1-1.py --server に全単語を問い合わせる時間と，lec1-2.pyで答えファイルを作る時間を測る
+#         実行時間，words/s，ピークRSS，score_checkerで確かめたスコアを表示する
+#         synthetic_<N>.txt はランダムな文字列N語の入力（seed固定なので毎回同じ）
+
+import argparse
+import importlib
+import io
+import json
+import os
+import random
+import string
+import subprocess
+import sys
+import time
+
+import score_checker
+
+anagram = importlib.import_module('lec1-2')
+
+DATA_FILES = ['small.txt', 'medium.txt', 'large.txt']
+SYNTHETIC_SEED = 0
+
+
+def read_lines(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return [line.strip() for line in file]
+
+
+def run_engine(engine, words, dictionary):
+    prepare, solve = anagram.ENGINES[engine]
+    begin = time.perf_counter()
+    prepared = prepare(dictionary)
+    prepared_at = time.perf_counter()
+    best_anagrams = solve(words, prepared)
+    end = time.perf_counter()
+    return best_anagrams, prepared_at - begin, end - prepared_at
+
+
+def compare_engines(engines, data_files):
+    dictionary = read_lines(anagram.DICT_FILE)
+    print("%-12s %-8s %10s %10s %12s %s" % ("file", "engine", "prepare", "solve", "words/s", "same"))
+    for data_file in data_files:
+        words = read_lines(data_file)
+        expected = None
+        for engine in engines:
+            best_anagrams, prepare_time, solve_time = run_engine(engine, words, dictionary)
+            if expected is None:
+                expected = best_anagrams
+            print("%-12s %-8s %9.3fs %9.3fs %12.1f %s" % (
+                data_file, engine, prepare_time, solve_time,
+                len(words) / solve_time, best_anagrams == expected))
+
+
+def make_synthetic(count):
+    path = f"synthetic_{count}.txt"
+    if not os.path.exists(path):
+        rng = random.Random(SYNTHETIC_SEED)
+        with open(path, 'w', encoding='utf-8') as file:
+            for _ in range(count):
+                length = rng.randint(4, 20)
+                file.write(''.join(rng.choices(string.ascii_lowercase, k=length)) + '\n')
+    return path
+
+
+def count_lines(path):
+    with open(path, 'rb') as file:
+        return sum(1 for _ in file)
+
+
+#子プロセスを実行して (実行時間, ピークRSS[MB]) を返す
+def run_measured(args, stdin_path=None):
+    stdin = open(stdin_path, 'rb') if stdin_path else subprocess.DEVNULL
+    try:
+        begin = time.perf_counter()
+        process = subprocess.Popen(args, stdin=stdin, stdout=subprocess.DEVNULL)
+        _, status, usage = os.wait4(process.pid, 0) #このプロセスだけのrusageが取れる
+        wall = time.perf_counter() - begin
+    finally:
+        if stdin_path:
+            stdin.close()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} exited with {process.returncode}")
+    max_rss = usage.ru_maxrss / 1024 #Linuxはキロバイト
+    if sys.platform == 'darwin': #macOSはバイト
+        max_rss /= 1024
+    return wall, max_rss
+
+
+def run_suite(data_files, engine, workers):
+    results = []
+    for data_file in data_files:
+        words = count_lines(data_file)
+
+        wall, max_rss = run_measured([sys.executable, 'lec1-1.py', '--server'], data_file)
+        results.append({'name': f"lookup:{data_file}", 'wall': wall, 'words': words,
+                        'words_per_sec': words / wall, 'peak_rss_mb': max_rss, 'score': None})
+
+        wall, max_rss = run_measured([sys.executable, 'lec1-2.py', data_file,
+                                      '--engine', engine, '--workers', str(workers)])
+        score, errors = score_checker.check(data_file, f"answer_{data_file}", out=io.StringIO())
+        results.append({'name': f"main:{engine}:{data_file}", 'wall': wall, 'words': words,
+                        'words_per_sec': words / wall, 'peak_rss_mb': max_rss,
+                        'score': score, 'errors': errors})
+    return results
+
+
+def print_results(results, baseline=None):
+    baseline = {result['name']: result for result in baseline or []}
+    print("%-32s %10s %12s %10s %10s %8s %s" % (
+        "case", "wall", "words/s", "rss(MB)", "score", "errors", "vs baseline"))
+    for result in results:
+        compared = ''
+        base = baseline.get(result['name'])
+        if base:
+            compared = "%.2fx speed" % (base['wall'] / result['wall'])
+            if base['score'] != result['score']:
+                compared += " (score was %s)" % base['score']
+        print("%-32s %9.3fs %12.1f %10.1f %10s %8s %s" % (
+            result['name'], result['wall'], result['words_per_sec'], result['peak_rss_mb'],
+            '-' if result['score'] is None else result['score'],
+            result.get('errors', '-'), compared))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    engines_parser = commands.add_parser('engines', help="lec1-2.pyのエンジンを比較する")
+    engines_parser.add_argument("--engines", nargs='+', choices=anagram.ENGINES,
+                                default=['naive', 'trie'])
+    engines_parser.add_argument("--files", nargs='+', default=DATA_FILES)
+
+    suite_parser = commands.add_parser('suite', help="lec1-1とlec1-2を別プロセスで測る")
+    suite_parser.add_argument("--files", nargs='+', default=DATA_FILES)
+    suite_parser.add_argument("--synthetic", nargs='*', type=int, default=[],
+                              help="ランダムな入力の語数（例: 100000 1000000）")
+    suite_parser.add_argument("--engine", choices=anagram.ENGINES, default='numpy',
+                              help="lec1-2.pyのエンジン（scoreはランダムな単語だと1語10ms以上かかる）")
+    suite_parser.add_argument("--workers", type=int, default=1)
+    suite_parser.add_argument("--save-baseline", help="結果をこのJSONファイルに保存する")
+    suite_parser.add_argument("--baseline", help="保存した結果と比べる")
+
+    args = parser.parse_args()
+    if args.command == 'engines':
+        compare_engines(args.engines, args.files)
+    else:
+        data_files = args.files + [make_synthetic(count) for count in args.synthetic]
+        results = run_suite(data_files, args.engine, args.workers)
+        baseline = None
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as file:
+                baseline = json.load(file)
+        print_results(results, baseline)
+        if args.save_baseline:
+            with open(args.save_baseline, 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
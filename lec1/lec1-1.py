@@ -1,64 +1,91 @@
 #１辞書の各単語をソート→ソート
 #２入力と同じものを見つけてソート前の単語を返す
 #(辞書にない単語がを探そうとした場合もつける？)
+#辞書はanagram_index.pyでファイルに保存しておき，起動のたびに作り直さない
+#--add/--remove/--compact で辞書を少しずつ更新できる（全部作り直さない）
 
-def sort_word(word): #入力文字列のソート
-    return ''.join(sorted(word))
-
-def sort_dictionary(dictionary):
-    return sorted(dictionary, key=lambda x: x[0]) #key=lamdaでソート基準を指定。それは要素xの0番目
-
-def create_new_dictionary(dictionary):
-    new_dictionary = [] #配列を定義
-    for word in dictionary:
-        new_dictionary.append((sort_word(word), word)) #並べ替えしたwordとwordのペアを新しい辞書に入れる
-    return new_dictionary
-
-def binary_search(sorted_word, dictionary): #act, (act, cat)
-    left = 0
-    right = len(dictionary) - 1
-    anagram_list = []
-
-
-    while left <= right:
-        mid = (left + right) // 2
-        if dictionary[mid][0] == sorted_word:
-            while mid > 0 and dictionary[mid-1][0] == sorted_word:
-                mid -= 1
-            while mid < len(dictionary) and dictionary[mid][0] == sorted_word:
-                anagram_list.append(dictionary[mid][1])
-                mid += 1
-            return anagram_list  # 元の単語を返す
-        elif dictionary[mid][0] < sorted_word:
-            left = mid + 1
-        else:
-            right = mid - 1
-    return []  # 見つからなかった場合
-
-
-# テキストファイルを開いて各行を配列に格納する
-with open('words.txt', 'r') as file:
-    words_data = [line.strip() for line in file]
-
-#main
-search_word = input("input: ")
-
-new_dictionary = create_new_dictionary(words_data)
-sorted_new_dictionary = sort_dictionary(new_dictionary)
-
-result = binary_search(sort_word(search_word), sorted_new_dictionary)
-
-if result != -1:
-    print(f"{search_word}'s anagram = {result}.")
-else:
-    print(f"{search_word} is not found.")
-
-
-test1 =bool((binary_search(sort_word('act'), sorted_new_dictionary)) == ['act', 'cat']) #複数個
-print(test1)
-test2 =bool((binary_search(sort_word(' '), sorted_new_dictionary)) == []) #空文字
-print(test2)
-test3 = bool(binary_search(sort_word('abbuct'), sorted_new_dictionary) == []) #not found
-print(test3)
-test4 = bool(binary_search(sort_word('baduct'), sorted_new_dictionary) == ['abduct']) #普通
-print(test4)
+import argparse
+import sys
+
+from anagram_index import IncrementalIndex, binary_search, load_signature_index, sort_word
+from anagram_server import AnagramServer
+
+DICT_FILE = 'words.txt'
+
+
+#--signatureのときは文字の個数の署名で引く（ソートも二分探索もしない）
+#署名のハッシュ表は保存しておいたものを読むので，起動のたびには作らない
+def make_lookup(index, use_signature=False):
+    if use_signature:
+        return load_signature_index(index).find
+    return index.find
+
+
+#indexを渡すと !add/!remove/!compact で辞書を更新できる
+def serve(lookup, socket_path=None, index=None):
+    server = AnagramServer(lookup, index=index)
+    if socket_path is None:
+        server.serve_stdin()
+    else:
+        server.serve_unix_socket(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", action='store_true',
+                        help="インデックスを開いたまま標準入力の各行に答え続ける")
+    parser.add_argument("--socket", help="--serverのとき標準入力の代わりにこのUnixソケットで待つ")
+    parser.add_argument("--signature", action='store_true',
+                        help="二分探索の代わりに文字の個数の署名のハッシュ表で引く")
+    parser.add_argument("--add", nargs='+', default=[], help="辞書に単語を追加する")
+    parser.add_argument("--remove", nargs='+', default=[], help="辞書から単語を消す")
+    parser.add_argument("--compact", action='store_true',
+                        help="変更ログをwords.txtとインデックスに反映する")
+    parser.add_argument("--test", action='store_true', help="署名のハッシュ表のテスト(test5, test6)も行う")
+    args = parser.parse_args()
+
+    #words.txtが変わっていなければ保存済みのインデックスを開き，変更ログを重ねるだけ
+    index = IncrementalIndex(DICT_FILE)
+    if args.add or args.remove or args.compact:
+        for word in args.add:
+            print(f"add {word}: {index.add_word(word)}")
+        for word in args.remove:
+            print(f"remove {word}: {index.remove_word(word)}")
+        if args.compact:
+            index.compact()
+        print(f"{index.pending_changes()} change(s) not compacted yet.")
+        sys.exit(0)
+
+    lookup = make_lookup(index, args.signature)
+    if args.server:
+        #署名のハッシュ表は起動時の辞書から作るので，そのときは更新を受け付けない
+        serve(lookup, args.socket, None if args.signature else index)
+        sys.exit(0)
+
+    search_word = input("input: ")
+
+    result = lookup(search_word)
+
+    if result != -1:
+        print(f"{search_word}'s anagram = {result}.")
+    else:
+        print(f"{search_word} is not found.")
+
+
+    test1 =bool((binary_search(sort_word('act'), index.base)) == ['act', 'cat']) #複数個
+    print(test1)
+    test2 =bool((binary_search(sort_word(' '), index.base)) == []) #空文字
+    print(test2)
+    test3 = bool(binary_search(sort_word('abbuct'), index.base) == []) #not found
+    print(test3)
+    test4 = bool(binary_search(sort_word('baduct'), index.base) == ['abduct']) #普通
+    print(test4)
+
+    if not args.test:
+        sys.exit(0)
+
+    signature_lookup = lookup if args.signature else load_signature_index(index).find
+    test5 = bool(signature_lookup('act') == ['act', 'cat']) #署名でも同じ結果
+    print(test5)
+    test6 = bool(signature_lookup(' ') == [] and signature_lookup('abbuct') == [])
+    print(test6)
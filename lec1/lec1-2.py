@@ -2,8 +2,14 @@
 #１inputファイルと辞書をソート
 #２入力と同じものを見つけてソート前の単語を返す
 
-import sys
+import argparse
+import bisect
+import itertools
+import multiprocessing
+import os
 DICT_FILE = "words.txt"
+CHUNK_SIZE = 1000
+SCORES = [1, 3, 2, 2, 1, 3, 3, 1, 1, 4, 4, 2, 2, 1, 1, 3, 4, 1, 1, 1, 2, 3, 3, 4, 3, 4]
 
 def count_alphabet(word):
     count = [0] * 26
@@ -12,6 +18,14 @@ def count_alphabet(word):
         count[ord(i) - ord('a')] += 1
     return count
 
+#使っている文字の集合を26bitのマスクにする
+def letter_mask(count):
+    mask = 0
+    for i in range(26):
+        if count[i]:
+            mask |= 1 << i
+    return mask
+
 #アルファベットの出現頻度
 def is_anagram(w_cnt, dic_cnt):
     for i in range(26):
@@ -20,10 +34,16 @@ def is_anagram(w_cnt, dic_cnt):
     return True
 
 
-def find_anagram(words, dictionary):
+def count_dictionary(dictionary):
     new_dictionary = [] #配列を定義
     for word in dictionary:
         new_dictionary.append((word, count_alphabet(word)))
+    return new_dictionary
+
+
+def find_anagram(words, dictionary, new_dictionary=None):
+    if new_dictionary is None:
+        new_dictionary = count_dictionary(dictionary)
     anagrams = []
 
     for word in words:
@@ -38,47 +58,220 @@ def find_anagram(words, dictionary):
 
 
 def calculate_score(word):
-    SCORES = [1, 3, 2, 2, 1, 3, 3, 1, 1, 4, 4, 2, 2, 1, 1, 3, 4, 1, 1, 1, 2, 3, 3, 4, 3, 4]
     score = 0
     for character in list(word):
         score += SCORES[ord(character) - ord('a')]
     return score
 
 
-def main(words_path):
-    dict_path = 'words.txt'
-    dictionary, words = [], []
-    with open(dict_path, 'r', encoding='utf-8') as dict_file:
-        for line in dict_file:
-            dictionary.append(line.strip())
+#エンジンは (辞書の前処理, 入力単語の処理) の組
+#前処理の結果は --workers のとき各プロセスに一度だけ渡す
+#処理は入力単語ごとに一番スコアの高いanagramを返す（なければNone）
+#同点のときは辞書で先に出てくる単語
 
-    with open(words_path, 'r', encoding='utf-8') as words_file:
-        for line in words_file:
-            words.append(line.strip())
 
-    anagrams = find_anagram(words, dictionary)
+def solve_naive(words, new_dictionary):
+    anagrams = find_anagram(words, None, new_dictionary)
 
-    max_scores = []
+    best_anagrams = []
     for anagram_list in anagrams:
         max_score = (0, None)
         for anagram in anagram_list:
             current_score = calculate_score(anagram)
             if max_score[0] < current_score:
                 max_score = (current_score, anagram)
-        max_scores.append(max_score)
+        best_anagrams.append(max_score[1])
+    return best_anagrams
 
-    with open(f"answer_{words_path}", 'w', encoding='utf-8') as file:
-        for (_, anagram) in max_scores:
-            file.write(f"{anagram}\n")
 
+#辞書を 単語数x26 のuint8行列にして，入力単語ごとに全行をまとめて比較する
+def prepare_numpy(dictionary):
+    import numpy as np
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("usage: %s data_file" % sys.argv[0])
-        exit(1)
-    main(sys.argv[1])
+    scores = np.array(SCORES, dtype=np.int32)
+    lengths = np.array([len(word) for word in dictionary], dtype=np.int64)
+    letters = np.frombuffer(''.join(dictionary).encode('ascii'), dtype=np.uint8) - ord('a')
+    word_ids = np.repeat(np.arange(len(dictionary)), lengths)
+
+    #counts[i][c] = i番目の単語に含まれる文字cの個数
+    counts = np.bincount(word_ids * 26 + letters, minlength=len(dictionary) * 26)
+    counts = counts.reshape(len(dictionary), 26).astype(np.uint8)
+    dict_scores = np.bincount(word_ids, weights=scores[letters], minlength=len(dictionary))
+    #使っている文字の集合を26bitのマスクにしたもの
+    masks = np.bitwise_or.reduce(np.where(counts > 0, 1 << np.arange(26), 0), axis=1)
+    return (dictionary, lengths, counts, dict_scores, masks, counts.max(axis=0))
+
+
+def solve_numpy(words, prepared):
+    import numpy as np
+
+    dictionary, lengths, counts, dict_scores, masks, max_counts = prepared
+    best_anagrams = []
+    for word in words:
+        word_cnt = np.array(count_alphabet(word), dtype=np.uint8)
+        word_mask = letter_mask(word_cnt)
+        #入力に無い文字を使う単語を先に除いてから個数を比較する
+        candidates = np.flatnonzero(((masks & ~word_mask) == 0) & (lengths <= len(word)))
+        #辞書のどの単語よりも多く持っている文字は比較しなくてよい
+        columns = np.flatnonzero((word_cnt > 0) & (word_cnt < max_counts))
+        candidates = candidates[(counts[candidates][:, columns] <= word_cnt[columns]).all(axis=1)]
+        if len(candidates) == 0:
+            best_anagrams.append(None)
+        else:
+            #argmaxは最初の最大値を返すので同点なら辞書で先の単語になる
+            best_anagrams.append(dictionary[candidates[np.argmax(dict_scores[candidates])]])
+    return best_anagrams
+
+
+#辞書をスコアの高い順に並べておき，最初に作れた単語を答えにする
+#長さと文字マスクで先にふるい落としてからis_anagramで個数を比較する
+def prepare_score(dictionary):
+    entries = []
+    for word in dictionary:
+        count = count_alphabet(word)
+        entries.append((calculate_score(word), len(word), letter_mask(count), count, word))
+    entries.sort(key=lambda entry: -entry[0]) #安定ソートなので同点は辞書順のまま
+    neg_scores = [-entry[0] for entry in entries]
+    return (entries, neg_scores)
+
+
+def solve_score(words, prepared):
+    entries, neg_scores = prepared
+    best_anagrams = []
+    for word in words:
+        word_cnt = count_alphabet(word)
+        word_mask = letter_mask(word_cnt)
+        word_length = len(word)
+        #入力単語そのもののスコアより高い単語は作れないので飛ばす
+        start = bisect.bisect_left(neg_scores, -calculate_score(word))
+        best = None
+        for _, length, mask, count, dic_word in itertools.islice(entries, start, None):
+            if length <= word_length and mask & ~word_mask == 0 and is_anagram(word_cnt, count):
+                best = dic_word
+                break
+        best_anagrams.append(best)
+    return best_anagrams
+
+
+#ソートした文字列をtrieにして，残りの文字で進める枝だけをたどる
+#節点: (子のリスト, この節点で終わる単語, 部分木で一番良い(スコア, -辞書での位置))
+#子のリストは部分木の最良値の高い順に並べておき，今の答えを超えない部分木は飛ばす
+def prepare_trie(dictionary):
+    root = {}
+    for index, word in enumerate(dictionary):
+        node = root
+        for character in sorted(word):
+            node = node.setdefault(character, {})
+        if None not in node: #同じ文字の組み合わせなら辞書で先の単語が答え
+            node[None] = (calculate_score(word), -index, word)
+
+    def freeze(node):
+        children = []
+        terminal = node.pop(None, None)
+        best = terminal[:2] if terminal else (0, 0)
+        for character, child in node.items():
+            child = freeze(child)
+            children.append((ord(character) - ord('a'), child))
+            best = max(best, child[2])
+        children.sort(key=lambda item: item[1][2], reverse=True)
+        return (children, terminal, best)
 
-    
+    return freeze(root)
 
 
+def solve_trie(words, root):
+    best_anagrams = []
+    for word in words:
+        remaining = count_alphabet(word)
+        best = [(0, 0), None]
+
+        def search(node):
+            terminal = node[1]
+            if terminal and terminal[:2] > best[0]:
+                best[0], best[1] = terminal[:2], terminal[2]
+            for character, child in node[0]:
+                if child[2] <= best[0]: #残りの子はもっと悪いので打ち切り
+                    break
+                if remaining[character]:
+                    remaining[character] -= 1
+                    search(child)
+                    remaining[character] += 1
+
+        search(root)
+        best_anagrams.append(best[1])
+    return best_anagrams
+
+
+ENGINES = {
+    'naive': (count_dictionary, solve_naive),
+    'numpy': (prepare_numpy, solve_numpy),
+    'score': (prepare_score, solve_score),
+    'trie': (prepare_trie, solve_trie),
+}
+
+
+def find_best_anagrams(words, dictionary, engine='naive'):
+    prepare, solve = ENGINES[engine]
+    return solve(words, prepare(dictionary))
+
+
+#入力ファイルをCHUNK_SIZE語ずつに分けて読む（大きいファイルも全部は読み込まない）
+def read_chunks(words_path, chunk_size=CHUNK_SIZE):
+    with open(words_path, 'r', encoding='utf-8') as words_file:
+        chunk = []
+        for line in words_file:
+            chunk.append(line.strip())
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+#ワーカープロセスごとに一度だけ前処理済みの辞書を受け取っておく
+worker_engine = None
 
+def init_worker(engine, prepared):
+    global worker_engine
+    worker_engine = (ENGINES[engine][1], prepared)
+
+def solve_chunk(words):
+    solve, prepared = worker_engine
+    return solve(words, prepared)
+
+
+def main(words_path, engine='naive', workers=1):
+    dict_path = DICT_FILE
+    dictionary = []
+    with open(dict_path, 'r', encoding='utf-8') as dict_file:
+        for line in dict_file:
+            dictionary.append(line.strip())
+
+    prepare, solve = ENGINES[engine]
+    prepared = prepare(dictionary)
+
+    with open(f"answer_{words_path}", 'w', encoding='utf-8') as file:
+        if workers == 1:
+            for chunk in read_chunks(words_path):
+                for anagram in solve(chunk, prepared):
+                    file.write(f"{anagram}\n")
+        else:
+            with multiprocessing.Pool(workers, initializer=init_worker,
+                                      initargs=(engine, prepared)) as pool:
+                #imapは入力の順番どおりに結果を返す
+                for best_anagrams in pool.imap(solve_chunk, read_chunks(words_path)):
+                    for anagram in best_anagrams:
+                        file.write(f"{anagram}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_file")
+    parser.add_argument("--engine", choices=ENGINES, default='naive',
+                        help="naive: 元の全探索, numpy: 文字数行列でまとめて比較, "
+                             "score: スコア順に探して最初に見つかった単語で打ち切り, "
+                             "trie: ソートした単語のtrieを残りの文字で枝刈りしながら探索")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="使うプロセス数（0ならCPUのコア数）")
+    args = parser.parse_args()
+    main(args.data_file, args.engine, args.workers or os.cpu_count())
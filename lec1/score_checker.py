@@ -1,7 +1,10 @@
 #! /usr/bin/python3
 
+import itertools
 import sys
 
+from anagram_index import count_signature
+
 # How to use:
 #
 # $ python3 score_checker.py your_answer_file
@@ -32,34 +35,59 @@ def read_words(word_file):
             words.append(line)
     return words
 
+# Compares the letter-count signatures (see anagram_index.py) of the two
+# words, so neither word has to be sorted.
 def is_anagram(anagram, data):
-    data_table = [0] * 26
-    for character in data:
-        data_table[ord(character) - ord('a')] += 1
-    for character in anagram:
-        if (data_table[ord(character) - ord('a')] == 0):
+    anagram_table = count_signature(anagram)
+    data_table = count_signature(data)
+    if anagram_table is None or data_table is None:
+        return False
+    for i in range(26):
+        if anagram_table[i] > data_table[i]:
             return False
-        data_table[ord(character) - ord('a')] -= 1
     return True
 
+def read_word_set(word_file):
+    words = set()
+    with open(word_file) as f:
+        for line in f:
+            words.add(line.rstrip('\n'))
+    return words
+
+# Reads the data file and the answer file together line by line, so the
+# files don't have to fit in memory. Every failure is reported to |out|,
+# not just the first one. Returns (score of the valid answers, errors).
+def check(data_file, answer_file, out=sys.stdout):
+    valid_words = read_word_set(WORDS_FILE)
+    score = 0
+    errors = 0
+    with open(data_file) as data_f, open(answer_file) as answer_f:
+        for line_number, (data_word, answer_word) in enumerate(
+                itertools.zip_longest(data_f, answer_f), 1):
+            if data_word is None or answer_word is None:
+                print("The number of words in %s and %s doesn't match." %
+                      (data_file, answer_file), file=out)
+                errors += 1
+                break
+            data_word = data_word.rstrip('\n')
+            answer_word = answer_word.rstrip('\n')
+            if not is_anagram(answer_word, data_word):
+                print("line %d: '%s' is not an anagram of '%s'." %
+                      (line_number, answer_word, data_word), file=out)
+                errors += 1
+                continue
+            if answer_word not in valid_words:
+                print("line %d: '%s' is not a valid word!" % (line_number, answer_word), file=out)
+                errors += 1
+                continue
+            score += calculate_score(answer_word)
+    return score, errors
+
 def main(data_file, answer_file):
-    valid_words = read_words(WORDS_FILE)
-    data_words = read_words(data_file)
-    answer_words = read_words(answer_file)
-    if len(data_words) != len(answer_words):
-        print("The number of words in %s and %s doesn't match." %
-              (data_file, answer_file))
+    score, errors = check(data_file, answer_file)
+    if errors:
+        print('%d error(s) found. Your score without them is %d.' % (errors, score))
         exit(1)
-    score = 0
-    for i in range(len(data_words)):
-        if not is_anagram(answer_words[i], data_words[i]):
-            print("'%s' is not an anagram of '%s'." %
-                  (answer_words[i], data_words[i]))
-            exit(1)
-        if answer_words[i] not in valid_words:
-            print("'%s' is not a valid word!" % answer_words[i])
-            exit(1)
-        score += calculate_score(answer_words[i])
     print('You answer is correct! Your score is %d.' % score)
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+#lec2のハッシュテーブルを，いろいろな使われ方（ワークロード）で比べるベンチマーク
+#
+# $ python3 benchmark.py                                        # 全実装，一様なkeyで読み80%
+# $ python3 benchmark.py --implementations chain open --size 1000000 --operations 1000000
+# $ python3 benchmark.py --distribution zipf --zipf-s 1.2 --read-ratio 0.95
+# $ python3 benchmark.py --key-length 8-64 --delete-ratio 0.1   # keyの長さがばらばら，削除が多い
+# $ python3 benchmark.py --size 10000000 --no-memory --implementations chain open
+#
+#1. size個の異なるkeyを作ってテーブルに入れる（このときtracemallocでメモリを測る）
+#2. operations回の操作を行う。操作ごとに時間を測り，ops/sとレイテンシのパーセンタイルを出す
+#   get: read_ratio，delete: delete_ratio，残りはput（消したkeyはputでまた入るのでchurnになる）
+#   どのkeyを使うかは一様かZipf（少数のkeyに集中する）
+#loadの時間はtracemallocでメモリを測る分だけ遅くなる（正しい時間は--no-memoryで）
+#ops/sは1回ごとの時間測定(perf_counter)の分も含むので，実際より少しだけ遅く出る
+#mmapはデータがファイルにあるので，bytes/entryはファイルの使用量で数える
+
+import argparse
+import bisect
+import importlib
+import itertools
+import json
+import os
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+
+better = importlib.import_module('lec2-1_better')
+concurrent = importlib.import_module('lec2-1_concurrent')
+mmap_table = importlib.import_module('lec2-1_mmap')
+stats = importlib.import_module('lec2-1_stats')
+tree = importlib.import_module('lec2-2')
+
+IMPLEMENTATIONS = dict(better.IMPLEMENTATIONS, **{
+    'concurrent': concurrent.ConcurrentHashTable,
+    'mmap': None, #一時ファイルが要るのでmake_tableで作る
+    'instrumented': stats.InstrumentedHashTable,
+    'btree': tree.BPlusTree,
+})
+PERCENTILES = [50, 90, 99, 99.9]
+KEY_CHARS = string.ascii_letters + string.digits
+
+
+#"16" なら16文字固定，"8-64" なら8〜64文字の一様分布
+def parse_key_length(text):
+    low, _, high = text.partition('-')
+    return int(low), int(high or low)
+
+
+#i番目のkey。先頭をiの16進数にして重ならないようにし，残りをランダムな文字で埋める
+def make_keys(count, key_length, rng):
+    low, high = key_length
+    keys = []
+    for i in range(count):
+        prefix = "%x." % i
+        length = rng.randint(low, high)
+        keys.append(prefix + ''.join(rng.choices(KEY_CHARS, k=max(length - len(prefix), 0))))
+    rng.shuffle(keys)
+    return keys
+
+
+#使うkeyの番号をoperations個。zipfなら番号が小さいほどよく使われる（keysはシャッフル済み）
+def make_key_indexes(count, operations, distribution, zipf_s, rng):
+    if distribution == 'uniform':
+        return [rng.randrange(count) for _ in range(operations)]
+    cum_weights = list(itertools.accumulate(1 / (rank ** zipf_s) for rank in range(1, count + 1)))
+    total = cum_weights[-1]
+    return [bisect.bisect_left(cum_weights, rng.random() * total) for _ in range(operations)]
+
+
+#0: get, 1: put, 2: delete
+def make_operations(operations, read_ratio, delete_ratio, rng):
+    ops = []
+    for _ in range(operations):
+        r = rng.random()
+        ops.append(0 if r < read_ratio else 2 if r < read_ratio + delete_ratio else 1)
+    return ops
+
+
+def make_table(name, directory):
+    if name == 'mmap':
+        return mmap_table.MmapHashTable(os.path.join(directory, "table.mmht"))
+    return IMPLEMENTATIONS[name]()
+
+
+def table_bytes(table, traced):
+    if isinstance(table, mmap_table.MmapHashTable):
+        return table.end
+    return traced
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(int(len(sorted_values) * p / 100), len(sorted_values) - 1)]
+
+
+def run(name, keys, key_indexes, ops, measure_memory):
+    with tempfile.TemporaryDirectory() as directory:
+        if measure_memory:
+            tracemalloc.start()
+        begin = time.perf_counter()
+        table = make_table(name, directory)
+        for key in keys:
+            table.put(key, key) #valueはkeyと同じオブジェクトなのでメモリに数えない
+        load_time = time.perf_counter() - begin
+        traced = 0
+        if measure_memory:
+            traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+        latencies = [0] * len(ops)
+        get, put, delete = table.get, table.put, table.delete
+        clock = time.perf_counter_ns
+        begin = time.perf_counter()
+        for i, (op, key_index) in enumerate(zip(ops, key_indexes)):
+            key = keys[key_index]
+            op_begin = clock()
+            if op == 0:
+                get(key)
+            elif op == 1:
+                put(key, key)
+            else:
+                delete(key)
+            latencies[i] = clock() - op_begin
+        elapsed = time.perf_counter() - begin
+
+        memory = table_bytes(table, traced)
+        if hasattr(table, 'close'):
+            table.close()
+
+    latencies.sort()
+    result = {'name': name, 'load_seconds': load_time, 'ops_per_sec': len(ops) / elapsed,
+              'max_us': latencies[-1] / 1000 if latencies else 0,
+              'bytes_per_entry': memory / len(keys) if measure_memory and keys else None}
+    for p in PERCENTILES:
+        result['p%s_us' % p] = percentile(latencies, p) / 1000 if latencies else 0
+    return result
+
+
+def print_results(results):
+    print("%-13s %9s %12s %9s %9s %9s %9s %10s %12s" % (
+        "table", "load", "ops/s", "p50(us)", "p90", "p99", "p99.9", "max", "bytes/entry"))
+    for result in results:
+        print("%-13s %8.2fs %12.0f %9.2f %9.2f %9.2f %9.2f %10.1f %12s" % (
+            result['name'], result['load_seconds'], result['ops_per_sec'], result['p50_us'],
+            result['p90_us'], result['p99_us'], result['p99.9_us'], result['max_us'],
+            '-' if result['bytes_per_entry'] is None else "%.1f" % result['bytes_per_entry']))
+
+
+def main(args):
+    assert 0 <= args.read_ratio + args.delete_ratio <= 1, "read_ratio + delete_ratio must be <= 1"
+    rng = random.Random(args.seed)
+    keys = make_keys(args.size, parse_key_length(args.key_length), rng)
+    key_indexes = make_key_indexes(args.size, args.operations, args.distribution, args.zipf_s, rng)
+    ops = make_operations(args.operations, args.read_ratio, args.delete_ratio, rng)
+    print("size %d, operations %d, get %.0f%% / put %.0f%% / delete %.0f%%, %s keys, key length %s" % (
+        args.size, args.operations, args.read_ratio * 100,
+        (1 - args.read_ratio - args.delete_ratio) * 100, args.delete_ratio * 100,
+        args.distribution if args.distribution == 'uniform' else "zipf(s=%g)" % args.zipf_s,
+        args.key_length))
+    results = [run(name, keys, key_indexes, ops, not args.no_memory) for name in args.implementations]
+    print_results(results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--implementations", nargs='+', choices=IMPLEMENTATIONS,
+                        default=list(IMPLEMENTATIONS))
+    parser.add_argument("--size", type=int, default=100000, help="最初に入れておくkeyの数")
+    parser.add_argument("--operations", type=int, default=200000)
+    parser.add_argument("--read-ratio", type=float, default=0.8, help="getの割合")
+    parser.add_argument("--delete-ratio", type=float, default=0.0, help="deleteの割合（残りはput）")
+    parser.add_argument("--distribution", choices=['uniform', 'zipf'], default='uniform')
+    parser.add_argument("--zipf-s", type=float, default=1.0, help="大きいほど少数のkeyに集中する")
+    parser.add_argument("--key-length", default="8-16", help="16（固定）か 8-64（範囲）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action='store_true', help="tracemallocで測らない（大きいsizeのとき）")
+    parser.add_argument("--json", help="結果をこのJSONファイルに保存する")
+    args = parser.parse_args()
+    results = main(args)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'workload': vars(args), 'results': results}, file, indent=2)
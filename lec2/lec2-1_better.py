@@ -1,4 +1,9 @@
-import random, sys, time
+import functools, random, sys, time
+
+try:
+    import numpy as np
+except ImportError: #numpyがなければcalculate_hash2_batchは1つずつ計算する
+    np = None
 
 #calcurate_hash2 文字の順序を考慮するハッシュ関数を作る
 
@@ -19,22 +24,58 @@ def calculate_hash2(key):
     return hash & 0xFFFFFFFF #64bit->32bit 32bitのハッシュ値が好ましい
 
 
+#たくさんのkeyのcalculate_hash2をnumpyでまとめて計算する（値はcalculate_hash2と同じ）
+#全keyを1本の配列（1文字=1要素のコードポイント）に詰め，長さの順に並べてから
+#「j文字目まであるkeyだけ hash = hash * 33 + c」を文字の位置ごとにまとめて行う
+#uint32の計算は自然に2^32で割った余りになるので & 0xFFFFFFFF と同じ
+def calculate_hash2_batch(keys):
+    keys = list(keys)
+    if np is None or not keys:
+        return [calculate_hash2(key) for key in keys]
+    lengths = np.array([len(key) for key in keys], dtype=np.int64)
+    chars = np.frombuffer(''.join(keys).encode('utf-32-le', 'surrogatepass'), dtype='<u4') #単独のサロゲートも1文字として扱う
+    offsets = np.zeros(len(keys), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+
+    order = np.argsort(-lengths, kind='stable') #長い順。j文字目があるkeyは先頭から続く
+    sorted_lengths = lengths[order]
+    sorted_offsets = offsets[order]
+    hashes = np.full(len(keys), 5381, dtype=np.uint32)
+    for j in range(int(sorted_lengths[0])):
+        active = np.searchsorted(-sorted_lengths, -j, side='left') #長さがjより大きいkeyの数
+        hashes[:active] = hashes[:active] * np.uint32(33) + chars[sorted_offsets[:active] + j]
+
+    result = np.empty(len(keys), dtype=np.uint32)
+    result[order] = hashes
+    return result.tolist()
+
+
+REHASH_STEP = 32 #段階的な再ハッシュで1回の操作ごとに移すbucketの数
+
 #大枠→細かい説明
 class Item:
-    def __init__(self, key, value, next):
+    __slots__ = ('key', 'value', 'next', 'hash') #__dict__を持たないので小さく速い
+
+    def __init__(self, key, value, next, hash=None):
         assert type(key) == str # key is str?
         self.key = key
         self.value = value
         self.next = next
+        self.hash = calculate_hash2(key) if hash is None else hash #rehashで計算し直さない
 
 
 class HashTable: #HashTableの定義，(key, value)を格納
 
-    def __init__(self):
+    #incremental=Trueのときは再ハッシュを一度にせず，操作のたびに少しずつ古いbucketから移す
+    def __init__(self, incremental=False):
         self.bucket_size = 97 #素数
         self.buckets = [None] * self.bucket_size
         self.item_count = 0 #ハッシュに入っているアイテム数をカウント
         self.temp = 0
+        self.incremental = incremental
+        self.old_buckets = None #段階的な再ハッシュ中だけ，まだ移し終わっていない古いbucket
+        self.old_bucket_size = 0
+        self.rehash_index = 0 #古いbucketのどこまで移したか
 
     def is_prime(self, n): #素数を得る
         if n <= 1:
@@ -58,6 +99,9 @@ class HashTable: #HashTableの定義，(key, value)を格納
         return n
     
     def rehash(self, new_bucket_size):
+        if self.incremental:
+            self.start_rehash(new_bucket_size)
+            return
         #new_bucket_size = max(self.next_prime(new_bucket_size), 100) #bucketサイズが100未満にならないよう制約
         new_buckets = [None] * new_bucket_size
         old_buckets =  self.buckets
@@ -72,19 +116,53 @@ class HashTable: #HashTableの定義，(key, value)を格納
         for item in old_buckets:
             while item: #item_を(self.put)
                 next_item = item.next
-                item.next = None #リストから取り外す
-                bucket_index = calculate_hash2(item.key) % self.bucket_size
-                if new_buckets[bucket_index] is None:
-                    new_buckets[bucket_index] = item
-                else:
-                    current_item = new_buckets[bucket_index]
-                    while current_item.next:
-                        current_item = current_item.next
-                    current_item.next = item
-                
-                #self.item_count += 1
+                bucket_index = item.hash % self.bucket_size #保存しておいたハッシュ値を使う
+                item.next = new_buckets[bucket_index] #新しいbucketの先頭につなぐのでO(1)
+                new_buckets[bucket_index] = item
                 item = next_item
 
+    #古いbucketを残したまま新しいbucketに切り替える。中身はrehash_stepで移す
+    def start_rehash(self, new_bucket_size):
+        if self.old_buckets is not None: #前の再ハッシュが終わっていなければ先に終わらせる
+            self.rehash_step(self.old_bucket_size)
+        self.old_buckets = self.buckets
+        self.old_bucket_size = self.bucket_size
+        self.rehash_index = 0
+        self.buckets = [None] * new_bucket_size
+        self.bucket_size = new_bucket_size
+
+    #古いbucketをstep個だけ新しいbucketに移す（1回の操作でかかる時間を抑える）
+    def rehash_step(self, step=REHASH_STEP):
+        if self.old_buckets is None:
+            return
+        end = min(self.rehash_index + step, self.old_bucket_size)
+        for bucket_index in range(self.rehash_index, end):
+            item = self.old_buckets[bucket_index]
+            while item:
+                next_item = item.next
+                new_index = item.hash % self.bucket_size
+                item.next = self.buckets[new_index]
+                self.buckets[new_index] = item
+                item = next_item
+            self.old_buckets[bucket_index] = None
+        self.rehash_index = end
+        if end == self.old_bucket_size:
+            self.old_buckets = None
+
+    def find_item(self, key, hash):
+        item = self.buckets[hash % self.bucket_size]
+        while item: #ハッシュテーブルから繋がるリスト内を検索（見つかるまでrepeat）
+            if item.hash == hash and item.key == key: #ハッシュ値が違えば文字列を比べない
+                return item
+            item = item.next #終わったら次のハッシュテーブルに移動
+        if self.old_buckets is not None: #まだ移していない古いbucketも探す（移したbucketはNone）
+            item = self.old_buckets[hash % self.old_bucket_size]
+            while item:
+                if item.hash == hash and item.key == key:
+                    return item
+                item = item.next
+        return None
+
     # Note: Don't change this function.
     def check_size(self):
         
@@ -103,15 +181,15 @@ class HashTable: #HashTableの定義，(key, value)を格納
     def put(self, key, value):
         assert type(key) == str
         self.check_size() #Don't remove this code.　再ハッシュが必要か判断し再サイズする
-        bucket_index = calculate_hash2(key) % self.bucket_size
-        item = self.buckets[bucket_index] #itemは[]番目の要素だよ
-        while item: #ハッシュテーブルから繋がるリスト内を検索（見つかるまでrepeat）
-            if item.key == key:
-                item.value = value
-                return False
-            item = item.next #終わったら次のハッシュテーブルに移動
+        self.rehash_step()
+        hash = calculate_hash2(key)
+        item = self.find_item(key, hash)
+        if item:
+            item.value = value
+            return False
 
-        new_item = Item(key, value, self.buckets[bucket_index])
+        bucket_index = hash % self.bucket_size
+        new_item = Item(key, value, self.buckets[bucket_index], hash)
         self.buckets[bucket_index] = new_item
         self.item_count += 1
         self.check_size()
@@ -121,48 +199,251 @@ class HashTable: #HashTableの定義，(key, value)を格納
     def get(self, key):
         assert type(key) == str
         self.check_size() # Note: Don't remove this code.
-        bucket_index = calculate_hash2(key) % self.bucket_size
-        item = self.buckets[bucket_index]
-        while item:
-            if item.key == key:
-                return (item.value, True)
-            item = item.next
+        self.rehash_step()
+        item = self.find_item(key, calculate_hash2(key))
+        if item:
+            return (item.value, True)
         return (None, False)
 
 
-    def delete(self, key):
-        assert type(key) == str
-        self.check_size()
-
-        bucket_index = calculate_hash2(key) % self.bucket_size
-        current_item = self.buckets[bucket_index] #bucket内の最初のアイテム
+    #bucketsのbucket_index番目のリストからkeyを外す
+    def unlink(self, buckets, bucket_index, key, hash):
+        current_item = buckets[bucket_index] #bucket内の最初のアイテム
         previous_item = None #前のアイテムを保持する変数を初期化
 
         while current_item: #itemを探す
-            if current_item.key == key:
+            if current_item.hash == hash and current_item.key == key:
                 if previous_item is None: #bucket内の最初のアイテムを削除したい
-                    self.buckets[bucket_index] = current_item.next
+                    buckets[bucket_index] = current_item.next
                 else:
                     previous_item.next = current_item.next #A->B->C を A->Cに付け替え
-                self.item_count -= 1
-                self.check_size()
                 return True
-        
+
             previous_item = current_item
             current_item = current_item.next
+        return False
 
-        return False # Not found
+    def delete(self, key):
+        assert type(key) == str
+        self.check_size()
+        self.rehash_step()
+
+        hash = calculate_hash2(key)
+        found = self.unlink(self.buckets, hash % self.bucket_size, key, hash)
+        if not found and self.old_buckets is not None:
+            found = self.unlink(self.old_buckets, hash % self.old_bucket_size, key, hash)
+        if not found:
+            return False # Not found
+
+        self.item_count -= 1
+        self.check_size()
+        return True
 
-        pass
+    #まとめて入れる前に，新しく入るincoming個を足しても0.7を超えない大きさにしておく（大きくするだけ）
+    def presize(self, incoming):
+        new_bucket_size = self.bucket_size
+        while self.item_count + incoming >= new_bucket_size * 0.7:
+            new_bucket_size *= 2
+        if new_bucket_size != self.bucket_size:
+            self.rehash(new_bucket_size)
+        if self.old_buckets is not None: #まとめて操作するときは再ハッシュを先に終わらせる
+            self.rehash_step(self.old_bucket_size)
+
+    #(key, value)の組をまとめて入れる。新しく入ったkeyの数を返す
+    #1. すでにあるkeyはその場で値を変え，新しいkeyだけを集める
+    #2. 新しいkeyの数だけpresizeしてから入れる（すでにあるkeyの分まで大きくすると，
+    #   最後のcheck_sizeでまた小さくされて再ハッシュが2回になる）
+    #サイズの確認は最初と最後の一回ずつだけ
+    def put_many(self, items):
+        items = list(items)
+        assert all(type(key) == str for key, _ in items)
+        if self.old_buckets is not None:
+            self.rehash_step(self.old_bucket_size)
+        buckets = self.buckets
+        bucket_size = self.bucket_size
+        new_items = {} #key -> (value, hash)。同じkeyが何回あっても最後の値
+        hashes = calculate_hash2_batch(key for key, _ in items)
+        for (key, value), hash in zip(items, hashes):
+            item = buckets[hash % bucket_size]
+            while item:
+                if item.hash == hash and item.key == key:
+                    item.value = value
+                    break
+                item = item.next
+            else:
+                new_items[key] = (value, hash)
+
+        self.presize(len(new_items))
+        buckets = self.buckets
+        bucket_size = self.bucket_size
+        for key, (value, hash) in new_items.items():
+            bucket_index = hash % bucket_size
+            buckets[bucket_index] = Item(key, value, buckets[bucket_index], hash)
+        self.item_count += len(new_items)
+        self.check_size()
+        return len(new_items)
+
+    #keyごとに (value, 見つかったか) のリストを返す
+    def get_many(self, keys):
+        keys = list(keys)
+        assert all(type(key) == str for key in keys)
+        self.check_size()
+        if self.old_buckets is not None:
+            self.rehash_step(self.old_bucket_size)
+        buckets = self.buckets
+        bucket_size = self.bucket_size
+        results = []
+        for key, hash in zip(keys, calculate_hash2_batch(keys)):
+            item = buckets[hash % bucket_size]
+            while item:
+                if item.hash == hash and item.key == key:
+                    results.append((item.value, True))
+                    break
+                item = item.next
+            else:
+                results.append((None, False))
+        return results
+
+    #まとめて消して，消えたkeyの数を返す。最後に一度だけ小さくする
+    def delete_many(self, keys):
+        keys = list(keys)
+        assert all(type(key) == str for key in keys)
+        if self.old_buckets is not None:
+            self.rehash_step(self.old_bucket_size)
+        buckets = self.buckets
+        bucket_size = self.bucket_size
+        deleted = 0
+        for key, hash in zip(keys, calculate_hash2_batch(keys)):
+            if self.unlink(buckets, hash % bucket_size, key, hash):
+                deleted += 1
+        self.item_count -= deleted
+
+        new_bucket_size = self.bucket_size
+        while new_bucket_size >= 200 and self.item_count <= new_bucket_size * 0.3:
+            new_bucket_size //= 2
+        if new_bucket_size != self.bucket_size:
+            self.rehash(new_bucket_size)
+        self.check_size()
+        return deleted
 
     # Return the total number of items in the hash table.
     def size(self):
         return self.item_count
 
 
+#オープンアドレス法（線形探査）のハッシュテーブル
+#Itemを作らず，ハッシュ値・key・valueを3本の平らなリストに並べて持つ
+#削除した場所には墓石(DELETED)を置き，探査がそこで止まらないようにする
+EMPTY = -1
+DELETED = -2
+
+class OpenAddressingHashTable:
+
+    def __init__(self):
+        self.bucket_size = 128 #2の累乗にしておくと & で余りが取れる
+        self.hashes = [EMPTY] * self.bucket_size
+        self.keys = [None] * self.bucket_size
+        self.values = [None] * self.bucket_size
+        self.item_count = 0
+        self.deleted_count = 0 #墓石の数
+
+    #keyが入っている場所，なければ-1
+    def find_slot(self, key, hash):
+        mask = self.bucket_size - 1
+        hashes = self.hashes
+        index = hash & mask
+        while hashes[index] != EMPTY:
+            if hashes[index] == hash and self.keys[index] == key:
+                return index
+            index = (index + 1) & mask
+        return -1
+
+    def rehash(self, new_bucket_size):
+        old_hashes, old_keys, old_values = self.hashes, self.keys, self.values
+        self.bucket_size = new_bucket_size
+        self.hashes = [EMPTY] * new_bucket_size
+        self.keys = [None] * new_bucket_size
+        self.values = [None] * new_bucket_size
+        self.deleted_count = 0 #墓石はここで全部なくなる
+        mask = new_bucket_size - 1
+        for i in range(len(old_hashes)):
+            hash = old_hashes[i]
+            if hash >= 0:
+                index = hash & mask
+                while self.hashes[index] != EMPTY:
+                    index = (index + 1) & mask
+                self.hashes[index] = hash
+                self.keys[index] = old_keys[i]
+                self.values[index] = old_values[i]
+
+    def check_size(self):
+        #墓石も探査を長くするので使用中として数える
+        if self.item_count + self.deleted_count >= self.bucket_size * 0.7:
+            if self.item_count >= self.bucket_size * 0.35:
+                self.rehash(self.bucket_size * 2)
+            else:
+                self.rehash(self.bucket_size) #墓石の掃除だけ
+        elif self.bucket_size > 128 and self.item_count <= self.bucket_size * 0.15:
+            self.rehash(self.bucket_size // 2)
+
+    def put(self, key, value):
+        assert type(key) == str
+        hash = calculate_hash2(key)
+        mask = self.bucket_size - 1
+        index = hash & mask
+        first_deleted = -1
+        while self.hashes[index] != EMPTY:
+            if self.hashes[index] == DELETED:
+                if first_deleted < 0:
+                    first_deleted = index
+            elif self.hashes[index] == hash and self.keys[index] == key:
+                self.values[index] = value
+                return False
+            index = (index + 1) & mask
+        if first_deleted >= 0: #墓石があれば再利用する
+            index = first_deleted
+            self.deleted_count -= 1
+        self.hashes[index] = hash
+        self.keys[index] = key
+        self.values[index] = value
+        self.item_count += 1
+        self.check_size()
+        return True
+
+    def get(self, key):
+        assert type(key) == str
+        index = self.find_slot(key, calculate_hash2(key))
+        if index < 0:
+            return (None, False)
+        return (self.values[index], True)
+
+    def delete(self, key):
+        assert type(key) == str
+        index = self.find_slot(key, calculate_hash2(key))
+        if index < 0:
+            return False
+        self.hashes[index] = DELETED
+        self.keys[index] = None
+        self.values[index] = None
+        self.item_count -= 1
+        self.deleted_count += 1
+        self.check_size()
+        return True
+
+    def size(self):
+        return self.item_count
+
+
+IMPLEMENTATIONS = {
+    'chain': HashTable,
+    'incremental': functools.partial(HashTable, incremental=True),
+    'open': OpenAddressingHashTable,
+}
+
+
 # Test the functional behavior of the hash table.
-def functional_test():
-    hash_table = HashTable()
+def functional_test(hash_table_class=HashTable):
+    hash_table = hash_table_class()
 
     assert hash_table.put("aaa", 1) == True
     assert hash_table.get("aaa") == (1, True)
@@ -226,19 +507,64 @@ def functional_test():
     print("Functional tests passed!")
 
 
-def performance_test():
-    hash_table = HashTable()
+# Test the batch APIs against the one-by-one APIs.
+def batch_test(hash_table_class=HashTable):
+    hash_table = hash_table_class()
+    keys = [str(i) for i in range(100000)]
+
+    odd_keys = ["", "a", "ab", "abc" * 50, "日本語", "\U0001F600x", "a\udc80", "\ud800"] + keys[:1000]
+    assert calculate_hash2_batch(odd_keys) == [calculate_hash2(key) for key in odd_keys]
+    assert calculate_hash2_batch([]) == []
+    surrogate_table = hash_table_class() #os.fsdecodeが作るようなkeyもput_manyで入れられる
+    surrogate_table.put_many([("a\udc80", 1)])
+    assert surrogate_table.get("a\udc80") == (1, True)
+    assert surrogate_table.put_many([("dup", 1), ("dup", 2)]) == 1 #同じkeyは最後の値
+    assert surrogate_table.get("dup") == (2, True) and surrogate_table.size() == 2
+
+    assert hash_table.put_many((key, int(key)) for key in keys) == 100000
+    assert hash_table.size() == 100000
+    bucket_size = hash_table.bucket_size #すでにあるkeyだけなら再ハッシュしない
+    assert hash_table.put_many((key, int(key)) for key in keys) == 0
+    assert hash_table.bucket_size == bucket_size and hash_table.size() == 100000
+    assert hash_table.put_many([("0", -1), ("new", 1)]) == 1
+    assert hash_table.get("0") == (-1, True)
+    assert hash_table.get_many(["1", "new", "nothing"]) == [(1, True), (1, True), (None, False)]
+    assert hash_table.delete_many(keys + ["nothing"]) == 100000
+    assert hash_table.size() == 1
+    assert hash_table.get_many(["1", "new"]) == [(None, False), (1, True)]
+    assert hash_table.delete_many(["new"]) == 1
+    assert hash_table.size() == 0
+
+    begin = time.time()
+    hash_table = hash_table_class()
+    for key in keys:
+        hash_table.put(key, key)
+    one_by_one = time.time() - begin
+    begin = time.time()
+    hash_table = hash_table_class()
+    hash_table.put_many((key, key) for key in keys)
+    print("Batch tests passed! (put: %.3fs, put_many: %.3fs)" % (one_by_one, time.time() - begin))
+
+
+#1回ごとの操作時間を測り，最後にp50/p99/maxを出す（再ハッシュの待ち時間が見える）
+def performance_test(hash_table_class=HashTable):
+    hash_table = hash_table_class()
+    latencies = []
 
     for iteration in range(100):
         begin = time.time()
         random.seed(iteration)
         for i in range(10000):
             rand = random.randint(0, 100000000)
+            op_begin = time.perf_counter()
             hash_table.put(str(rand), str(rand))
+            latencies.append(time.perf_counter() - op_begin)
         random.seed(iteration)
         for i in range(10000):
             rand = random.randint(0, 100000000)
+            op_begin = time.perf_counter()
             hash_table.get(str(rand))
+            latencies.append(time.perf_counter() - op_begin)
         end = time.time()
         print("%d %.6f" % (iteration, end - begin))
 
@@ -246,12 +572,23 @@ def performance_test():
         random.seed(iteration)
         for i in range(10000):
             rand = random.randint(0, 100000000)
+            op_begin = time.perf_counter()
             hash_table.delete(str(rand))
+            latencies.append(time.perf_counter() - op_begin)
 
     assert hash_table.size() == 0
+    latencies.sort()
+    print("latency p50 %.2fus p99 %.2fus max %.2fus" % (
+        latencies[len(latencies) // 2] * 1e6,
+        latencies[len(latencies) * 99 // 100] * 1e6,
+        latencies[-1] * 1e6))
     print("Performance tests passed!")
 
 
+# $ python3 lec2-1_better.py [chain|incremental|open]
 if __name__ == "__main__":
-    functional_test()
-    performance_test()
\ No newline at end of file
+    hash_table_class = IMPLEMENTATIONS[sys.argv[1] if len(sys.argv) > 1 else 'chain']
+    functional_test(hash_table_class)
+    if hasattr(hash_table_class(), 'put_many'):
+        batch_test(hash_table_class)
+    performance_test(hash_table_class)
\ No newline at end of file
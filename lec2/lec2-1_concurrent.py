@@ -0,0 +1,192 @@
+import importlib, random, threading, time
+
+#複数スレッドから同時に使えるハッシュテーブル
+#
+#・ロックのストライプ: bucketをSTRIPES本のロックで分担する（bucket i はロック i % STRIPES）
+#  bucketの数はいつもSTRIPESの倍数なので，同じkeyは再ハッシュ後も同じロックになる
+#・読み込み(get)はロックを取らない。bucketの先頭の付け替えやvalueの書き換えは
+#  1回の代入なので，GILの下では読む側は古いか新しいかのどちらかの状態を見る
+#・再ハッシュは全部のロックを取って書き込みだけを止め，Itemを作り直して新しい配列に入れる
+#  古い配列のItemはいじらないので，読む側は再ハッシュ中も古い配列をそのまま読める
+#  最後にself.bucketsを新しい配列に1回の代入で切り替える
+
+better = importlib.import_module('lec2-1_better')
+calculate_hash2 = better.calculate_hash2
+Item = better.Item
+
+STRIPES = 64
+
+
+class ConcurrentHashTable:
+
+    def __init__(self):
+        self.buckets = [None] * (STRIPES * 2)
+        self.locks = [threading.Lock() for _ in range(STRIPES)]
+        self.counts = [0] * STRIPES #ストライプごとのアイテム数（そのストライプのロックで守る）
+        self.resize_lock = threading.Lock() #再ハッシュは一度に一つだけ
+        self.rehash_count = 0
+
+    def get(self, key):
+        assert type(key) == str
+        hash = calculate_hash2(key)
+        buckets = self.buckets #途中で切り替わっても同じ配列を最後まで読む
+        item = buckets[hash % len(buckets)]
+        while item:
+            if item.hash == hash and item.key == key:
+                return (item.value, True)
+            item = item.next
+        return (None, False)
+
+    def put(self, key, value):
+        assert type(key) == str
+        hash = calculate_hash2(key)
+        stripe = hash % STRIPES
+        with self.locks[stripe]:
+            buckets = self.buckets #再ハッシュ中は全部のロックが取られているので，ここでは切り替わらない
+            bucket_index = hash % len(buckets)
+            item = buckets[bucket_index]
+            while item:
+                if item.hash == hash and item.key == key:
+                    item.value = value
+                    return False
+                item = item.next
+            buckets[bucket_index] = Item(key, value, buckets[bucket_index], hash)
+            self.counts[stripe] += 1
+            grow = self.counts[stripe] >= len(buckets) // STRIPES * 0.7
+        if grow: #ロックを離してから再ハッシュする
+            self.rehash(len(buckets), len(buckets) * 2)
+        return True
+
+    def delete(self, key):
+        assert type(key) == str
+        hash = calculate_hash2(key)
+        stripe = hash % STRIPES
+        with self.locks[stripe]:
+            buckets = self.buckets
+            bucket_index = hash % len(buckets)
+            current_item = buckets[bucket_index]
+            previous_item = None
+            while current_item:
+                if current_item.hash == hash and current_item.key == key:
+                    #読んでいる途中のスレッドはcurrent_item.nextから先をそのまま読める
+                    if previous_item is None:
+                        buckets[bucket_index] = current_item.next
+                    else:
+                        previous_item.next = current_item.next
+                    self.counts[stripe] -= 1
+                    break
+                previous_item = current_item
+                current_item = current_item.next
+            else:
+                return False
+            shrink = (len(buckets) > STRIPES * 2 and
+                      self.counts[stripe] <= len(buckets) // STRIPES * 0.2)
+        if shrink and self.size() <= len(buckets) * 0.2:
+            self.rehash(len(buckets), len(buckets) // 2)
+        return True
+
+    def rehash(self, old_bucket_size, new_bucket_size):
+        with self.resize_lock:
+            if len(self.buckets) != old_bucket_size: #ほかのスレッドがもう再ハッシュした
+                return
+            for lock in self.locks: #いつも同じ順番で取るのでデッドロックしない
+                lock.acquire()
+            try:
+                new_buckets = [None] * new_bucket_size
+                for item in self.buckets:
+                    while item:
+                        bucket_index = item.hash % new_bucket_size
+                        new_buckets[bucket_index] = Item(item.key, item.value,
+                                                         new_buckets[bucket_index], item.hash)
+                        item = item.next
+                self.buckets = new_buckets
+                self.rehash_count += 1
+            finally:
+                for lock in self.locks:
+                    lock.release()
+
+    def size(self):
+        return sum(self.counts)
+
+
+#いくつかのスレッドでput/get/deleteを混ぜて行い，結果が正しいか確かめる
+#読むだけのスレッドは，最初に入れたkeyが再ハッシュ中でも必ず見つかることを確かめる
+def stress_test(threads=8, operations=20000):
+    hash_table = ConcurrentHashTable()
+    for i in range(1000):
+        hash_table.put("fixed%d" % i, i)
+    errors = []
+    done = threading.Event()
+
+    def writer(thread_id):
+        rng = random.Random(thread_id)
+        mine = {}
+        for _ in range(operations):
+            key = "t%d-%d" % (thread_id, rng.randint(0, 5000))
+            op = rng.random()
+            if op < 0.5:
+                hash_table.put(key, thread_id)
+                mine[key] = thread_id
+            elif op < 0.8:
+                if hash_table.get(key) != (mine.get(key), key in mine):
+                    errors.append("get %s" % key)
+            else:
+                if hash_table.delete(key) != (key in mine):
+                    errors.append("delete %s" % key)
+                mine.pop(key, None)
+        for key, value in mine.items():
+            if hash_table.get(key) != (value, True):
+                errors.append("final %s" % key)
+        return mine
+
+    def reader():
+        while not done.is_set():
+            for i in range(0, 1000, 7):
+                if hash_table.get("fixed%d" % i) != (i, True):
+                    errors.append("fixed%d" % i)
+
+    results = [None] * threads
+    def run_writer(thread_id):
+        results[thread_id] = writer(thread_id)
+    reader_thread = threading.Thread(target=reader)
+    reader_thread.start()
+    writers = [threading.Thread(target=run_writer, args=(i,)) for i in range(threads)]
+    for thread in writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    reader_thread.join()
+
+    assert errors == [], errors[:10]
+    assert hash_table.size() == 1000 + sum(len(mine) for mine in results)
+    print("Stress tests passed! (%d rehashes)" % hash_table.rehash_count)
+
+
+def throughput_test(operations=200000):
+    for threads in (1, 2, 4, 8):
+        hash_table = ConcurrentHashTable()
+
+        def work(thread_id):
+            rng = random.Random(thread_id)
+            for _ in range(operations // threads):
+                key = str(rng.randint(0, 100000))
+                if rng.random() < 0.2:
+                    hash_table.put(key, key)
+                else:
+                    hash_table.get(key)
+
+        workers = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+        begin = time.time()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.time() - begin
+        print("%d threads: %.0f ops/s" % (threads, operations / elapsed))
+
+
+if __name__ == "__main__":
+    better.functional_test(ConcurrentHashTable)
+    stress_test()
+    throughput_test()
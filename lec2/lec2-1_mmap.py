@@ -0,0 +1,279 @@
+import functools, importlib, mmap, os, pickle, struct, tempfile
+
+#ファイルに保存されるハッシュテーブル（mmapで読み書きする）
+#開くときはヘッダを読むだけなので一瞬で開け，RAMより大きい表も必要なページだけ読まれる
+#
+#ファイル形式（オフセットはすべてファイル先頭からの位置，0は「なし」）
+#  ヘッダ: MAGIC, bucket配列の位置, bucketの数, アイテム数, 使用済みの末尾, 空きエントリのリスト,
+#         大きさの区分ごとの空き領域のリスト（SIZE_CLASSES個）
+#  bucket配列: bucketの数 個のuint64（そのbucketの最初のエントリの位置）
+#  エントリ（48バイト固定）: 次のエントリ, ハッシュ値, keyの長さ, valueの位置, valueの長さ, key
+#    keyは20バイトまでならエントリの中に入れ，それより長ければ後ろの領域に置いて位置だけ入れる
+#  後ろの領域(extent): 長いkey・value（pickle）・bucket配列のバイト列
+#
+#extentは大きさを2の累乗（16バイト以上）に切り上げて取る。いらなくなったextent
+#（削除したkeyとvalue，書き換え前のvalue，再ハッシュ前のbucket配列）は同じ大きさの区分の空きリストにつなぎ，
+#次に同じ区分の大きさが要るときに使い回す。削除したエントリも空きリストで使い回す
+#なので同じくらいの大きさのkey/valueを入れたり消したりしてもファイルは大きくならない
+#まだ無駄になる分:
+#  ・切り上げた分（最大で半分弱）
+#  ・空いたextentは別の区分には使わない（小さいvalueを消して大きいvalueを入れるとファイルは伸びる）
+#  ・ファイルは縮めない（空いた領域を末尾から返すことはしない）
+
+better = importlib.import_module('lec2-1_better')
+calculate_hash2 = better.calculate_hash2
+
+MAGIC = b"MMHT0002"
+SIZE_CLASSES = 64 #区分iの大きさは 2 ** i バイト
+MIN_EXTENT = 16
+HEADER = struct.Struct("<8sQQQQQ%dQ" % SIZE_CLASSES)
+ENTRY = struct.Struct("<QIIQI20s")
+OFFSET = struct.Struct("<Q")
+INLINE_KEY_SIZE = 20
+INITIAL_BUCKET_SIZE = 1024
+
+
+#sizeバイトが入る一番小さい区分
+def size_class(size):
+    return max(size - 1, MIN_EXTENT - 1).bit_length()
+
+
+class MmapHashTable:
+
+    def __init__(self, path, bucket_size=INITIAL_BUCKET_SIZE):
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, 'r+b' if exists else 'w+b')
+        if exists:
+            self.mm = mmap.mmap(self.file.fileno(), 0)
+            if len(self.mm) < HEADER.size or self.mm[:len(MAGIC)] != MAGIC: #ヘッダーより短いファイルも同じ扱い
+                self.mm.close()
+                self.file.close()
+                raise ValueError(f"{path} is not a hash table file")
+            _, self.bucket_offset, self.bucket_size, self.item_count, self.end, \
+                self.free_entry, *self.free_extents = HEADER.unpack_from(self.mm, 0)
+        else:
+            self.file.truncate(HEADER.size)
+            self.mm = mmap.mmap(self.file.fileno(), 0)
+            self.bucket_size = bucket_size
+            self.item_count = 0
+            self.end = HEADER.size
+            self.free_entry = 0
+            self.free_extents = [0] * SIZE_CLASSES
+            self.bucket_offset = self.allocate_extent(OFFSET.size * bucket_size) #伸ばした部分は0で埋まっている
+            self.write_header()
+
+    def write_header(self):
+        HEADER.pack_into(self.mm, 0, MAGIC, self.bucket_offset, self.bucket_size,
+                         self.item_count, self.end, self.free_entry, *self.free_extents)
+
+    #ファイルの末尾にsizeバイトの領域を取る。足りなければファイルを倍に伸ばしてmmapし直す
+    def allocate(self, size):
+        offset = self.end
+        self.end += size
+        if self.end > len(self.mm):
+            new_length = max(len(self.mm) * 2, self.end)
+            self.mm.close()
+            self.file.truncate(new_length) #伸ばした部分は0で埋まる
+            self.mm = mmap.mmap(self.file.fileno(), 0)
+        return offset
+
+    #sizeバイトのextentを取る。同じ区分の空きがあればそれを使う
+    def allocate_extent(self, size):
+        size_index = size_class(size)
+        offset = self.free_extents[size_index]
+        if offset:
+            self.free_extents[size_index] = OFFSET.unpack_from(self.mm, offset)[0]
+            return offset
+        return self.allocate(1 << size_index)
+
+    #sizeバイトで取ったextentを空きリストの先頭につなぐ（先頭8バイトに次の空きの位置を書く）
+    def free_extent(self, offset, size):
+        size_index = size_class(size)
+        OFFSET.pack_into(self.mm, offset, self.free_extents[size_index])
+        self.free_extents[size_index] = offset
+
+    def write_bytes(self, data):
+        offset = self.allocate_extent(len(data))
+        self.mm[offset:offset + len(data)] = data
+        return offset
+
+    def bucket_head(self, bucket_index):
+        return OFFSET.unpack_from(self.mm, self.bucket_offset + OFFSET.size * bucket_index)[0]
+
+    def set_bucket_head(self, bucket_index, entry):
+        OFFSET.pack_into(self.mm, self.bucket_offset + OFFSET.size * bucket_index, entry)
+
+    def entry_key(self, key_size, key_field):
+        if key_size <= INLINE_KEY_SIZE:
+            return key_field[:key_size]
+        key_offset = OFFSET.unpack_from(key_field)[0]
+        return self.mm[key_offset:key_offset + key_size]
+
+    #(見つかったエントリ, その一つ前のエントリ) 見つからなければエントリは0
+    def find(self, key_bytes, hash):
+        previous = 0
+        entry = self.bucket_head(hash % self.bucket_size)
+        while entry:
+            next_entry, entry_hash, key_size, _, _, key_field = ENTRY.unpack_from(self.mm, entry)
+            if (entry_hash == hash and key_size == len(key_bytes)
+                    and self.entry_key(key_size, key_field) == key_bytes):
+                return entry, previous
+            previous = entry
+            entry = next_entry
+        return 0, previous
+
+    def rehash(self, new_bucket_size):
+        new_offset = self.allocate_extent(OFFSET.size * new_bucket_size)
+        self.mm[new_offset:new_offset + OFFSET.size * new_bucket_size] = bytes(OFFSET.size * new_bucket_size)
+        for bucket_index in range(self.bucket_size):
+            entry = self.bucket_head(bucket_index)
+            while entry:
+                next_entry, entry_hash = struct.unpack_from("<QI", self.mm, entry)
+                new_index = entry_hash % new_bucket_size
+                head = OFFSET.unpack_from(self.mm, new_offset + OFFSET.size * new_index)[0]
+                OFFSET.pack_into(self.mm, entry, head) #エントリのnextを付け替える
+                OFFSET.pack_into(self.mm, new_offset + OFFSET.size * new_index, entry)
+                entry = next_entry
+        self.free_extent(self.bucket_offset, OFFSET.size * self.bucket_size)
+        self.bucket_offset = new_offset
+        self.bucket_size = new_bucket_size
+        self.write_header()
+
+    def check_size(self):
+        if self.item_count >= self.bucket_size * 0.7:
+            self.rehash(self.bucket_size * 2)
+
+    def put(self, key, value):
+        assert type(key) == str
+        key_bytes = key.encode('utf-8')
+        value_bytes = pickle.dumps(value)
+        hash = calculate_hash2(key)
+        entry, _ = self.find(key_bytes, hash)
+        if entry:
+            next_entry, _, key_size, value_offset, value_size, key_field = ENTRY.unpack_from(self.mm, entry)
+            if size_class(len(value_bytes)) == size_class(value_size): #同じ区分なら同じ場所に上書きする
+                self.mm[value_offset:value_offset + len(value_bytes)] = value_bytes
+            else:
+                self.free_extent(value_offset, value_size)
+                value_offset = self.write_bytes(value_bytes)
+            ENTRY.pack_into(self.mm, entry, next_entry, hash, key_size,
+                            value_offset, len(value_bytes), key_field)
+            self.write_header()
+            return False
+
+        if len(key_bytes) <= INLINE_KEY_SIZE:
+            key_field = key_bytes
+        else:
+            key_field = OFFSET.pack(self.write_bytes(key_bytes))
+        value_offset = self.write_bytes(value_bytes)
+        if self.free_entry: #削除したエントリを使い回す
+            entry = self.free_entry
+            self.free_entry = OFFSET.unpack_from(self.mm, entry)[0]
+        else:
+            entry = self.allocate(ENTRY.size)
+        bucket_index = hash % self.bucket_size
+        ENTRY.pack_into(self.mm, entry, self.bucket_head(bucket_index), hash, len(key_bytes),
+                        value_offset, len(value_bytes), key_field)
+        self.set_bucket_head(bucket_index, entry)
+        self.item_count += 1
+        self.write_header()
+        self.check_size()
+        return True
+
+    def get(self, key):
+        assert type(key) == str
+        entry, _ = self.find(key.encode('utf-8'), calculate_hash2(key))
+        if not entry:
+            return (None, False)
+        _, _, _, value_offset, value_size, _ = ENTRY.unpack_from(self.mm, entry)
+        return (pickle.loads(self.mm[value_offset:value_offset + value_size]), True)
+
+    def delete(self, key):
+        assert type(key) == str
+        hash = calculate_hash2(key)
+        entry, previous = self.find(key.encode('utf-8'), hash)
+        if not entry:
+            return False
+        next_entry, _, key_size, value_offset, value_size, key_field = ENTRY.unpack_from(self.mm, entry)
+        self.free_extent(value_offset, value_size)
+        if key_size > INLINE_KEY_SIZE:
+            self.free_extent(OFFSET.unpack_from(key_field)[0], key_size)
+        if previous:
+            OFFSET.pack_into(self.mm, previous, next_entry)
+        else:
+            self.set_bucket_head(hash % self.bucket_size, next_entry)
+        OFFSET.pack_into(self.mm, entry, self.free_entry) #空きリストの先頭につなぐ
+        self.free_entry = entry
+        self.item_count -= 1
+        self.write_header()
+        return True
+
+    def size(self):
+        return self.item_count
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#閉じて開き直しても中身が残っているか
+def persistence_test(path):
+    with MmapHashTable(path) as hash_table:
+        for i in range(5000):
+            hash_table.put("key%d" % i, i)
+        hash_table.put("long key " * 10, [1, 2, 3])
+        hash_table.delete("key0")
+    with MmapHashTable(path) as hash_table:
+        assert hash_table.size() == 5000
+        assert hash_table.get("key0") == (None, False)
+        assert hash_table.get("key4999") == (4999, True)
+        assert hash_table.get("long key " * 10) == ([1, 2, 3], True)
+        assert hash_table.put("key0", "again") == True #空きエントリを使い回す
+    for data in (b"MMHT00\x00\x00\x00", b"x" * HEADER.size): #ヘッダーより短い，magicが違う
+        with open(path, 'wb') as file:
+            file.write(data)
+        try:
+            MmapHashTable(path)
+            assert False, data
+        except ValueError:
+            pass
+    print("Persistence tests passed!")
+
+
+#入れて消すのを繰り返しても，空いた領域を使い回すのでファイルが伸び続けない
+def churn_test(path):
+    keys = ["key%d" % i + ("x" * 30 if i % 3 == 0 else "") for i in range(20000)] #3つに1つは長いkey
+    with MmapHashTable(path) as hash_table:
+        ends = []
+        for round in range(5):
+            for i, key in enumerate(keys):
+                hash_table.put(key, "value%d" % i)
+            hash_table.put(keys[1], "a much longer value " * 20) #区分が変わる書き換え
+            for key in keys:
+                hash_table.delete(key)
+            assert hash_table.size() == 0
+            ends.append(hash_table.end)
+        assert ends[-1] == ends[1], ends
+    print("Churn tests passed! (file %d bytes)" % ends[-1])
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "table.mmht")
+        better.functional_test(functools.partial(MmapHashTable, path))
+        os.remove(path)
+        persistence_test(path)
+        os.remove(path)
+        churn_test(path)
+        os.remove(path)
+        better.performance_test(functools.partial(MmapHashTable, path))
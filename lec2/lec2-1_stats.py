@@ -0,0 +1,237 @@
+import collections, hashlib, importlib, os, random, sys, time
+
+#HashTableがなぜ遅くなるのかを見るための計測
+#
+#・InstrumentedHashTable: HashTableの子クラス。使うときだけこちらを作る（HashTable自体は変えない）
+#  1回の操作で増やすのは数個のカウンタだけなので，入れたままでも重くならない
+#    getの回数とたどったItemの数（平均探査数），再ハッシュの回数・時間・前後のbucket数，
+#    負荷率の履歴（SAMPLE_EVERY回の操作ごと，と再ハッシュの前後）
+#  チェーンの長さの分布はbucketを全部見るので，chain_length_histogram()を呼んだときだけ計算する
+#・print_quality_report: calculate_hash1 / calculate_hash2 / seedつきのハッシュを
+#  実際のkeyの集合で比べ，偏りや狙ったような衝突がないかを調べる
+
+better = importlib.import_module('lec2-1_better')
+calculate_hash1 = better.calculate_hash1
+calculate_hash2 = better.calculate_hash2
+
+SAMPLE_EVERY = 1000 #負荷率を記録する間隔（操作の回数）
+HISTORY_SIZE = 1000 #履歴は新しいものからこの数だけ残す
+HASH_SEED = os.urandom(16) #プロセスごとに変わるので，外からはどのkeyが衝突するかわからない
+
+
+#blake2bにseedを鍵として入れたハッシュ（calculate_hash2と同じく32bit）
+def calculate_seeded_hash(key, seed=HASH_SEED):
+    assert type(key) == str
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=4, key=seed).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class TableStats:
+
+    def __init__(self):
+        self.operations = 0
+        self.gets = 0
+        self.get_probes = 0 #getでたどったItemの数の合計
+        self.rehashes = 0
+        self.rehash_seconds = 0.0
+        self.rehash_history = collections.deque(maxlen=HISTORY_SIZE) #(bucket数 前, 後, アイテム数, 秒)
+        self.load_factors = collections.deque(maxlen=HISTORY_SIZE) #(操作の回数, 負荷率)
+
+    def average_probes(self):
+        return self.get_probes / self.gets if self.gets else 0.0
+
+    def report(self):
+        return {'operations': self.operations, 'gets': self.gets,
+                'average_probes': self.average_probes(), 'rehashes': self.rehashes,
+                'rehash_seconds': self.rehash_seconds,
+                'last_rehash': self.rehash_history[-1] if self.rehash_history else None,
+                'load_factor': self.load_factors[-1][1] if self.load_factors else None}
+
+
+class InstrumentedHashTable(better.HashTable):
+
+    def __init__(self, incremental=False):
+        self.stats = TableStats() #親の__init__より先に作る（rehashから使うので）
+        self.probes = 0 #最後のfind_itemでたどったItemの数
+        super().__init__(incremental)
+
+    def load_factor(self):
+        return self.item_count / self.bucket_size
+
+    def count_operation(self):
+        stats = self.stats
+        stats.operations += 1
+        if stats.operations % SAMPLE_EVERY == 0:
+            stats.load_factors.append((stats.operations, self.load_factor()))
+
+    #探すのは親のfind_itemに任せ，見つかったItem（なければチェーンの最後）までをもう一度数える
+    #数える分だけ遅くなるのはこのクラスだけ
+    def find_item(self, key, hash):
+        found = super().find_item(key, hash)
+        probes, reached = self.count_chain(self.buckets, self.bucket_size, hash, found)
+        if not reached and self.old_buckets is not None:
+            probes += self.count_chain(self.old_buckets, self.old_bucket_size, hash, found)[0]
+        self.probes = probes
+        return found
+
+    #(チェーンの先頭からtargetまでのItemの数, targetがあったか)
+    def count_chain(self, buckets, bucket_size, hash, target):
+        count = 0
+        item = buckets[hash % bucket_size]
+        while item:
+            count += 1
+            if item is target:
+                return count, True
+            item = item.next
+        return count, False
+
+    #段階的な再ハッシュのときは切り替えだけの時間になる（移す時間は各操作に入る）
+    def rehash(self, new_bucket_size):
+        stats = self.stats
+        old_bucket_size = self.bucket_size
+        stats.load_factors.append((stats.operations, self.load_factor()))
+        begin = time.perf_counter()
+        super().rehash(new_bucket_size)
+        elapsed = time.perf_counter() - begin
+        stats.rehashes += 1
+        stats.rehash_seconds += elapsed
+        stats.rehash_history.append((old_bucket_size, new_bucket_size, self.item_count, elapsed))
+        stats.load_factors.append((stats.operations, self.load_factor()))
+
+    def put(self, key, value):
+        self.count_operation()
+        return super().put(key, value)
+
+    def get(self, key):
+        self.count_operation()
+        result = super().get(key)
+        self.stats.gets += 1
+        self.stats.get_probes += self.probes
+        return result
+
+    def delete(self, key):
+        self.count_operation()
+        return super().delete(key)
+
+    #{チェーンの長さ: bucketの数}
+    def chain_length_histogram(self):
+        histogram = collections.Counter()
+        for buckets in (self.buckets, self.old_buckets or []):
+            for item in buckets:
+                length = 0
+                while item:
+                    length += 1
+                    item = item.next
+                histogram[length] += 1
+        return dict(sorted(histogram.items()))
+
+
+#keyの集合に対して，ハッシュ関数ごとの偏りを調べる
+#  distinct: ハッシュ値（32bit全体）が何種類あるか。keyの数より少なければ完全に同じ値の衝突がある
+#  max_chain / empty: bucket_size個のbucketに分けたときの一番長いチェーンと空のbucketの割合
+#  quality: sum(b * (b + 1) / 2) / ((n / 2m) * (n + 2m - 1))  1に近いほど一様（1.05を超えたら要注意）
+def hash_quality(hash_function, keys, bucket_size):
+    begin = time.perf_counter()
+    hashes = [hash_function(key) for key in keys]
+    elapsed = time.perf_counter() - begin
+    counts = [0] * bucket_size
+    for hash in hashes:
+        counts[hash % bucket_size] += 1
+    n, m = len(keys), bucket_size
+    expected = (n / (2 * m)) * (n + 2 * m - 1)
+    return {'distinct': len(set(hashes)), 'max_chain': max(counts),
+            'empty': counts.count(0) / m,
+            'quality': sum(b * (b + 1) / 2 for b in counts) / expected,
+            'ns_per_key': elapsed / n * 1e9}
+
+
+HASH_FUNCTIONS = {
+    'hash1': calculate_hash1,
+    'hash2': calculate_hash2,
+    'seeded': calculate_seeded_hash,
+}
+
+
+def print_quality_report(key_sets, hash_functions=HASH_FUNCTIONS):
+    print("%-12s %-8s %8s %9s %10s %7s %8s %8s" % (
+        "keys", "hash", "count", "distinct", "max_chain", "empty", "quality", "ns/key"))
+    for name, keys in key_sets.items():
+        bucket_size = better.HashTable().next_prime(int(len(keys) / 0.7)) #負荷率0.7くらい
+        for hash_name, hash_function in hash_functions.items():
+            result = hash_quality(hash_function, keys, bucket_size)
+            print("%-12s %-8s %8d %9d %10d %6.1f%% %8.2f %8.0f" % (
+                name, hash_name, len(keys), result['distinct'], result['max_chain'],
+                result['empty'] * 100, result['quality'], result['ns_per_key']))
+
+
+#calculate_hash2（hash * 33 + c）で必ず同じ値になるkeyを作る
+#"ab" と "bA" は 'a' * 33 + 'b' == 'b' * 33 + 'A' なので，この2つを並べた文字列は全部衝突する
+def colliding_keys(blocks=12):
+    keys = ['']
+    for _ in range(blocks):
+        keys = [key + block for key in keys for block in ("ab", "bA")]
+    return keys
+
+
+def make_key_sets():
+    key_sets = {}
+    words_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lec1', 'words.txt')
+    if os.path.exists(words_path):
+        with open(words_path, 'r', encoding='utf-8') as file:
+            key_sets['words'] = [line.strip() for line in file if line.strip()]
+    random.seed(0)
+    key_sets['random_int'] = [str(random.randint(0, 100000000)) for _ in range(50000)] #performance_testのkey
+    key_sets['sequential'] = ["user%d" % i for i in range(50000)]
+    key_sets['url'] = ["https://example.com/page/%d" % i for i in range(50000)]
+    key_sets['anagrams'] = sorted({''.join(random.sample("abcdefghij", 10)) for _ in range(50000)})
+    key_sets['adversarial'] = colliding_keys()
+    return key_sets
+
+
+def instrumentation_test():
+    hash_table = InstrumentedHashTable()
+    for i in range(10000):
+        hash_table.put(str(i), i)
+    for i in range(10000):
+        assert hash_table.get(str(i)) == (i, True)
+    assert hash_table.get("none") == (None, False)
+    stats = hash_table.stats
+    assert stats.operations == 20001 and stats.gets == 10001
+    assert stats.get_probes >= 10000
+    assert stats.rehashes == len(stats.rehash_history) > 0
+    assert stats.rehash_history[0][:2] == (97, 194)
+    histogram = hash_table.chain_length_histogram()
+    assert sum(histogram.values()) == hash_table.bucket_size
+    assert sum(length * count for length, count in histogram.items()) == 10000
+    for i in range(10000):
+        hash_table.delete(str(i))
+    assert hash_table.stats.report()['load_factor'] is not None
+    assert colliding_keys(3)[0] != colliding_keys(3)[1]
+    assert len({calculate_hash2(key) for key in colliding_keys(3)}) == 1
+    print("Instrumentation tests passed!")
+
+
+#計測あり/なしでperformance_testと同じ操作の時間を比べる
+def overhead_test(incremental=False, operations=200000):
+    random.seed(0)
+    keys = [str(random.randint(0, 100000000)) for _ in range(operations)]
+    for name, hash_table_class in (("HashTable", better.HashTable),
+                                   ("Instrumented", InstrumentedHashTable)):
+        hash_table = hash_table_class(incremental)
+        begin = time.perf_counter()
+        for key in keys:
+            hash_table.put(key, key)
+        for key in keys:
+            hash_table.get(key)
+        print("%-13s %.3fs" % (name, time.perf_counter() - begin))
+    print("stats:", hash_table.stats.report())
+    print("chains:", hash_table.chain_length_histogram())
+
+
+# $ python3 lec2-1_stats.py [incremental]
+if __name__ == "__main__":
+    incremental = len(sys.argv) > 1 and sys.argv[1] == 'incremental'
+    better.functional_test(lambda: InstrumentedHashTable(incremental))
+    instrumentation_test()
+    overhead_test(incremental)
+    print_quality_report(make_key_sets())
@@ -0,0 +1,293 @@
+import bisect, importlib, random, time
+
+#lec2-2.txt の「木構造は順序を保つので範囲検索ができる」を実際に作ってみる
+#B+木: 値は全部葉に持ち，葉どうしを左から右へnextでつなぐ
+#範囲検索は最初の葉を木をたどって見つけ，あとはnextをたどるだけ
+#
+#ノードの大きさ: 1ノードにORDER個までのkey（Pythonのリストなのでポインタの連続した配列）
+#64個だと1ノードのポインタ配列が512バイトで，10万件でも3段程度の浅い木になる
+#ノード内はbisectで二分探索する
+
+hash_table = importlib.import_module('lec2-1_better') #ファイル名に-が入っているのでimport文では読めない
+
+ORDER = 64 #1ノードのkeyの最大数（内部ノードは子の最大数）
+MIN_KEYS = ORDER // 2 #根以外のノードはこれより少なくならないようにする
+
+
+class LeafNode:
+    __slots__ = ('keys', 'values', 'next')
+
+    def __init__(self, keys, values, next):
+        self.keys = keys
+        self.values = values
+        self.next = next #右隣の葉
+
+
+class InternalNode:
+    #children[i] のkey < keys[i] <= children[i + 1] のkey
+    __slots__ = ('keys', 'children')
+
+    def __init__(self, keys, children):
+        self.keys = keys
+        self.children = children
+
+
+class BPlusTree:
+
+    def __init__(self):
+        self.root = LeafNode([], [], None)
+        self.item_count = 0
+
+    def find_leaf(self, key):
+        node = self.root
+        while type(node) is InternalNode:
+            node = node.children[bisect.bisect_right(node.keys, key)]
+        return node
+
+    def get(self, key):
+        assert type(key) == str
+        leaf = self.find_leaf(key)
+        i = bisect.bisect_left(leaf.keys, key)
+        if i < len(leaf.keys) and leaf.keys[i] == key:
+            return (leaf.values[i], True)
+        return (None, False)
+
+    def put(self, key, value):
+        assert type(key) == str
+        added, split = self.insert(self.root, key, value)
+        if split: #根が分かれたら一段高くする
+            separator, right = split
+            self.root = InternalNode([separator], [self.root, right])
+        if added:
+            self.item_count += 1
+        return added
+
+    #(新しく入ったか, 分かれたときは (右のノードの最小key, 右のノード))
+    def insert(self, node, key, value):
+        if type(node) is LeafNode:
+            i = bisect.bisect_left(node.keys, key)
+            if i < len(node.keys) and node.keys[i] == key:
+                node.values[i] = value
+                return False, None
+            node.keys.insert(i, key)
+            node.values.insert(i, value)
+            if len(node.keys) <= ORDER:
+                return True, None
+            mid = len(node.keys) // 2
+            right = LeafNode(node.keys[mid:], node.values[mid:], node.next)
+            del node.keys[mid:]
+            del node.values[mid:]
+            node.next = right
+            return True, (right.keys[0], right)
+
+        i = bisect.bisect_right(node.keys, key)
+        added, split = self.insert(node.children[i], key, value)
+        if split:
+            separator, right = split
+            node.keys.insert(i, separator)
+            node.children.insert(i + 1, right)
+            if len(node.children) > ORDER:
+                mid = len(node.keys) // 2
+                separator = node.keys[mid]
+                right = InternalNode(node.keys[mid + 1:], node.children[mid + 1:])
+                del node.keys[mid:]
+                del node.children[mid + 1:]
+                return added, (separator, right)
+        return added, None
+
+    def delete(self, key):
+        assert type(key) == str
+        if not self.remove(self.root, key):
+            return False
+        if type(self.root) is InternalNode and len(self.root.children) == 1:
+            self.root = self.root.children[0] #根の子が一つになったら一段低くする
+        self.item_count -= 1
+        return True
+
+    def remove(self, node, key):
+        if type(node) is LeafNode:
+            i = bisect.bisect_left(node.keys, key)
+            if i == len(node.keys) or node.keys[i] != key:
+                return False
+            del node.keys[i]
+            del node.values[i]
+            return True
+
+        i = bisect.bisect_right(node.keys, key)
+        if not self.remove(node.children[i], key):
+            return False
+        self.rebalance(node, i)
+        return True
+
+    #node.children[i] が小さくなりすぎていたら，隣から借りるか隣とつなげる
+    def rebalance(self, node, i):
+        child = node.children[i]
+        left = node.children[i - 1] if i > 0 else None
+        right = node.children[i + 1] if i + 1 < len(node.children) else None
+
+        if type(child) is LeafNode:
+            if len(child.keys) >= MIN_KEYS:
+                return
+            if left and len(left.keys) > MIN_KEYS:
+                child.keys.insert(0, left.keys.pop())
+                child.values.insert(0, left.values.pop())
+                node.keys[i - 1] = child.keys[0]
+            elif right and len(right.keys) > MIN_KEYS:
+                child.keys.append(right.keys.pop(0))
+                child.values.append(right.values.pop(0))
+                node.keys[i] = right.keys[0]
+            elif left:
+                left.keys += child.keys
+                left.values += child.values
+                left.next = child.next
+                del node.keys[i - 1]
+                del node.children[i]
+            elif right:
+                child.keys += right.keys
+                child.values += right.values
+                child.next = right.next
+                del node.keys[i]
+                del node.children[i + 1]
+            return
+
+        if len(child.children) >= MIN_KEYS:
+            return
+        if left and len(left.children) > MIN_KEYS:
+            child.keys.insert(0, node.keys[i - 1])
+            child.children.insert(0, left.children.pop())
+            node.keys[i - 1] = left.keys.pop()
+        elif right and len(right.children) > MIN_KEYS:
+            child.keys.append(node.keys[i])
+            child.children.append(right.children.pop(0))
+            node.keys[i] = right.keys.pop(0)
+        elif left:
+            left.keys.append(node.keys[i - 1])
+            left.keys += child.keys
+            left.children += child.children
+            del node.keys[i - 1]
+            del node.children[i]
+        elif right:
+            child.keys.append(node.keys[i])
+            child.keys += right.keys
+            child.children += right.children
+            del node.keys[i]
+            del node.children[i + 1]
+
+    def size(self):
+        return self.item_count
+
+    #lo <= key < hi の (key, value) をkeyの順に返す。lo/hiがNoneならその側は制限なし
+    def range(self, lo=None, hi=None):
+        if lo is None:
+            leaf = self.first_leaf()
+            i = 0
+        else:
+            leaf = self.find_leaf(lo)
+            i = bisect.bisect_left(leaf.keys, lo)
+        while leaf:
+            keys = leaf.keys
+            while i < len(keys):
+                if hi is not None and keys[i] >= hi:
+                    return
+                yield (keys[i], leaf.values[i])
+                i += 1
+            leaf = leaf.next
+            i = 0
+
+    def __iter__(self):
+        return self.range()
+
+    def first_leaf(self):
+        node = self.root
+        while type(node) is InternalNode:
+            node = node.children[0]
+        return node
+
+    #一番小さい (key, value)，空ならNone
+    def min(self):
+        leaf = self.first_leaf()
+        if not leaf.keys:
+            return None
+        return (leaf.keys[0], leaf.values[0])
+
+    #一番大きい (key, value)，空ならNone
+    def max(self):
+        node = self.root
+        while type(node) is InternalNode:
+            node = node.children[-1]
+        if not node.keys:
+            return None
+        return (node.keys[-1], node.values[-1])
+
+
+#ランダムな操作をdictと比べ，順序と範囲検索も確かめる
+def ordered_test():
+    tree = BPlusTree()
+    expected = {}
+    random.seed(0)
+    for i in range(50000):
+        key = "%06d" % random.randint(0, 20000)
+        if random.random() < 0.6:
+            assert tree.put(key, i) == (key not in expected)
+            expected[key] = i
+        else:
+            assert tree.delete(key) == (key in expected)
+            expected.pop(key, None)
+    assert tree.size() == len(expected)
+    assert list(tree) == sorted(expected.items())
+    assert tree.min() == min(expected.items())
+    assert tree.max() == max(expected.items())
+    assert list(tree.range("005000", "006000")) == sorted(
+        (key, value) for key, value in expected.items() if "005000" <= key < "006000")
+    for key in list(expected):
+        assert tree.delete(key) == True
+    assert tree.size() == 0
+    assert tree.min() is None and tree.max() is None and list(tree) == []
+    print("Ordered tests passed!")
+
+
+#HashTableで範囲検索をするには全部のbucketを見るしかない
+def hash_table_range(table, lo, hi):
+    result = []
+    for item in table.buckets:
+        while item:
+            if lo <= item.key < hi:
+                result.append((item.key, item.value))
+            item = item.next
+    result.sort()
+    return result
+
+
+#点の検索と範囲検索の速さをHashTableと比べる
+def benchmark(count=100000, ranges=100, range_width=100):
+    random.seed(0)
+    keys = ["%08d" % random.randint(0, 10 ** 8) for _ in range(count)]
+    tree = BPlusTree()
+    table = hash_table.HashTable()
+    for key in keys:
+        tree.put(key, key)
+        table.put(key, key)
+    sorted_keys = sorted(set(keys))
+
+    for name, structure in (("HashTable", table), ("BPlusTree", tree)):
+        begin = time.time()
+        for key in keys:
+            structure.get(key)
+        elapsed = time.time() - begin
+        print("%-10s get:   %10.0f lookups/s" % (name, count / elapsed))
+
+    starts = [random.randint(0, len(sorted_keys) - range_width - 1) for _ in range(ranges)]
+    for name, scan in (("HashTable", lambda lo, hi: hash_table_range(table, lo, hi)),
+                       ("BPlusTree", lambda lo, hi: list(tree.range(lo, hi)))):
+        begin = time.time()
+        for start in starts:
+            lo, hi = sorted_keys[start], sorted_keys[start + range_width]
+            assert len(scan(lo, hi)) == range_width
+        elapsed = time.time() - begin
+        print("%-10s range: %10.1f scans/s (%d keys each)" % (name, ranges / elapsed, range_width))
+
+
+if __name__ == "__main__":
+    hash_table.functional_test(BPlusTree)
+    ordered_test()
+    benchmark()
@@ -0,0 +1,175 @@
+import importlib, random, time
+
+#lec2-3.txt のLRUキャッシュ
+#ハッシュテーブル: URL -> 双方向リストのノード
+#双方向リスト: (URL, Webページ) を新しく使った順に並べる。先頭が一番新しく，末尾が一番古い
+#検索・追加・更新・削除すべてO(1)
+
+hash_table = importlib.import_module('lec2-1_better')
+
+
+class Node:
+    __slots__ = ('url', 'page', 'size', 'prev', 'next')
+
+    def __init__(self, url, page, size):
+        self.url = url
+        self.page = page
+        self.size = size
+        self.prev = None
+        self.next = None
+
+
+class LRUCache:
+
+    #max_entries: 入れておけるページ数の上限（Noneなら制限なし）
+    #max_bytes: ページの大きさの合計の上限（Noneなら制限なし）。大きさはsize_of(page)で測る
+    def __init__(self, max_entries=None, max_bytes=None, size_of=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.table = hash_table.HashTable()
+        self.head = Node(None, None, 0) #番兵。head.nextが一番新しい
+        self.tail = Node(None, None, 0) #番兵。tail.prevが一番古い
+        self.head.next = self.tail
+        self.tail.prev = self.head
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def unlink(self, node): #リストから外す
+        node.prev.next = node.next
+        node.next.prev = node.prev
+
+    def push_front(self, node): #リストの先頭に入れる
+        node.prev = self.head
+        node.next = self.head.next
+        self.head.next.prev = node
+        self.head.next = node
+
+    def remove(self, node):
+        self.unlink(node)
+        self.table.delete(node.url)
+        self.total_bytes -= node.size
+
+    def evict(self): #上限に収まるまで一番古いものから捨てる
+        while self.tail.prev is not self.head and (
+                (self.max_entries is not None and self.table.size() > self.max_entries) or
+                (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            self.remove(self.tail.prev)
+            self.evictions += 1
+
+    #(page, True) か (None, False) を返す。見つかったらリストの先頭に動かす
+    def get(self, url):
+        node, found = self.table.get(url)
+        if not found:
+            self.misses += 1
+            return (None, False)
+        self.hits += 1
+        self.unlink(node)
+        self.push_front(node)
+        return (node.page, True)
+
+    def put(self, url, page):
+        size = self.size_of(page)
+        node, found = self.table.get(url)
+        if self.max_bytes is not None and size > self.max_bytes:
+            if found: #一つで上限を超えるページは入れない（古い内容も残さない）
+                self.remove(node)
+            return
+        if found: #すでにあればその位置だけ書き換えて先頭に動かす
+            self.total_bytes += size - node.size
+            node.page = page
+            node.size = size
+            self.unlink(node)
+        else:
+            node = Node(url, page, size)
+            self.table.put(url, node)
+            self.total_bytes += size
+        self.push_front(node)
+        self.evict()
+
+    def delete(self, url):
+        node, found = self.table.get(url)
+        if not found:
+            return False
+        self.remove(node)
+        return True
+
+    #キャッシュになければloader(url)で読み込んでキャッシュに入れる
+    def get_or_load(self, url, loader):
+        page, found = self.get(url)
+        if not found:
+            page = loader(url)
+            self.put(url, page)
+        return page
+
+    def size(self):
+        return self.table.size()
+
+    def urls(self): #新しい順
+        urls = []
+        node = self.head.next
+        while node is not self.tail:
+            urls.append(node.url)
+            node = node.next
+        return urls
+
+    def stats(self):
+        return {'entries': self.size(), 'bytes': self.total_bytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+def functional_test():
+    cache = LRUCache(max_entries=3)
+    cache.put("a.com", "A")
+    cache.put("b.com", "B")
+    cache.put("c.com", "C")
+    assert cache.urls() == ["c.com", "b.com", "a.com"]
+    assert cache.get("a.com") == ("A", True)
+    assert cache.urls() == ["a.com", "c.com", "b.com"]
+    cache.put("d.com", "D") #一番古いb.comが捨てられる
+    assert cache.urls() == ["d.com", "a.com", "c.com"]
+    assert cache.get("b.com") == (None, False)
+    cache.put("c.com", "CC") #更新
+    assert cache.urls() == ["c.com", "d.com", "a.com"]
+    assert cache.get("c.com") == ("CC", True)
+    assert cache.delete("d.com") == True
+    assert cache.delete("d.com") == False
+    assert cache.size() == 2
+    assert cache.stats() == {'entries': 2, 'bytes': 3, 'hits': 2, 'misses': 1, 'evictions': 1}
+
+    cache = LRUCache(max_bytes=10)
+    cache.put("a.com", "aaaa")
+    cache.put("b.com", "bbbb")
+    cache.put("c.com", "cccc") #合計12バイトになるのでa.comが捨てられる
+    assert cache.urls() == ["c.com", "b.com"]
+    assert cache.stats()['bytes'] == 8
+    cache.put("big.com", "x" * 11) #上限より大きいものは入れない
+    assert cache.urls() == ["c.com", "b.com"]
+
+    loaded = []
+    def loader(url):
+        loaded.append(url)
+        return url.upper()
+    cache = LRUCache(max_entries=2)
+    assert cache.get_or_load("a.com", loader) == "A.COM"
+    assert cache.get_or_load("a.com", loader) == "A.COM"
+    assert loaded == ["a.com"]
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    print("Functional tests passed!")
+
+
+def performance_test():
+    cache = LRUCache(max_entries=10000)
+    random.seed(0)
+    begin = time.time()
+    for i in range(200000):
+        cache.get_or_load("https://example.com/%d" % random.randint(0, 14999), lambda url: url)
+    print("200000 get_or_load: %.3fs %s" % (time.time() - begin, cache.stats()))
+    print("Performance tests passed!")
+
+
+if __name__ == "__main__":
+    functional_test()
+    performance_test()
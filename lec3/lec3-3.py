@@ -1,140 +1,122 @@
 #! /usr/bin/python3
 #　*と/に対応するように改良
 
-def read_number(line, index):
-    number = 0
-    while index < len(line) and line[index].isdigit():
-        number = number * 10 + int(line[index])
-        index += 1
-    if index < len(line) and line[index] == '.':
-        index += 1
-        decimal = 0.1
-        while index < len(line) and line[index].isdigit():
-            number += int(line[index]) * decimal
-            decimal /= 10
-            index += 1
-    token = {'type': 'NUMBER', 'number': number}
-    return token, index
+import operator, re, time
 
+#式の間違いを，lineの何文字目か（position）と一緒に知らせる
+class CalculatorError(Exception):
 
-def read_plus(line, index):
-    token = {'type': 'PLUS'}
-    return token, index + 1
+    def __init__(self, message, position=None):
+        super().__init__(message if position is None else "%s (at %d)" % (message, position))
+        self.position = position
 
 
-def read_minus(line, index):
-    token = {'type': 'MINUS'}
-    return token, index + 1
+#トークンは (種類, 値, 何文字目か) のタプル。種類は整数
+NUMBER, PLUS, MINUS, ASTERISK, SLASH, OPEN_PAREN, CLOSE_PAREN, END = range(8)
+TOKEN_NAMES = ['number', '+', '-', '*', '/', '(', ')', 'end']
 
-
-def read_asterisk(line, index):
-    token = {'type': 'ASTERISK'}
-    return token, index + 1
-
-
-def read_slash(line, index):
-    token = {'type': 'SLASH'}
-    return token, index + 1
-
-def read_open_paren(line, index):
-    token = {'type': 'OPEN_PAREN'}
-    return token, index + 1
-
-def read_close_paren(line, index):
-    token = {'type': 'CLOSE_PAREN'}
-    return token, index + 1
+#全部のトークンを一つの正規表現にまとめる。何番目のグループが一致したか(lastindex)が種類になる
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+      (\d+(?:\.\d*)?)          # NUMBER
+    | (\+) | (-) | (\*) | (/) | (\() | (\))
+    )""", re.VERBOSE)
+SPACE_PATTERN = re.compile(r"\s*")
 
 
+#最後に (END, None, len(line)) を付ける（構文解析で範囲外を調べなくてよくなる）
 def tokenize(line):
     tokens = []
     index = 0
-
-    while index < len(line):
-
-        if line[index].isdigit():
-            (token, index) = read_number(line, index)
-        elif line[index] == '+':
-            (token, index) = read_plus(line, index)
-        elif line[index] == '-':
-            (token, index) = read_minus(line, index)
-        elif line[index] == '*':
-            (token, index) = read_asterisk(line, index)
-        elif line[index] == '/':
-            (token, index) = read_slash(line, index)
-        elif line[index] == '(':
-            (token, index) = read_open_paren(line, index)
-        elif line[index] == ')':
-            (token, index) = read_close_paren(line, index)
+    length = len(line)
+    match = TOKEN_PATTERN.match
+    while True:
+        m = match(line, index)
+        if m is None:
+            index = SPACE_PATTERN.match(line, index).end()
+            if index == length:
+                break
+            raise CalculatorError("Invalid character found: " + line[index], index)
+        type = m.lastindex - 1
+        if type == NUMBER:
+            tokens.append((NUMBER, float(m.group(1)), m.start(1)))
         else:
-            print('Invalid character found: ' + line[index])
-            exit(1)
-        tokens.append(token)
+            tokens.append((type, None, m.start(type + 1)))
+        index = m.end()
+    tokens.append((END, None, length))
     return tokens
 
 
-#def evaluate(tokens):
+#構文解析: 演算子と（をスタックに積んでおく操車場アルゴリズム（shunting-yard）
+#トークンを前から1回読むだけで逆ポーランド記法(RPN)の列を作る
+#RPNの要素は (0, 数) か (1, 1項の関数) か (2, 2項の関数)
+#（）や-がいくつ入れ子になっても，Pythonの関数の再帰ではなくstackの長さが伸びるだけ
+#stackの要素は (優先順位, arity, 関数)。（ は優先順位OPEN
+PRECEDENCE = {PLUS: 1, MINUS: 1, ASTERISK: 2, SLASH: 2}
+UNARY_PRECEDENCE = 3 #-xは*や/より先に計算する
+OPEN = 0
+BINARY_OPERATORS = {PLUS: operator.add, MINUS: operator.sub,
+                    ASTERISK: operator.mul, SLASH: operator.truediv}
+
+
+def syntax_error(message, token):
+    raise CalculatorError('Invalid syntax: ' + message, token[2])
+
+
+def parse(tokens):
+    rpn = []
+    stack = []
+    expect_operand = True #次に来るのは数・（・-のどれか
+    for index, token in enumerate(tokens):
+        type, value, _ = token
+        if expect_operand:
+            if type == NUMBER:
+                rpn.append((0, value))
+                expect_operand = False
+            elif type == MINUS: #後ろの数を符号反転
+                stack.append((UNARY_PRECEDENCE, 1, operator.neg))
+            elif type == OPEN_PAREN:
+                stack.append((OPEN, 0, None))
+            elif type != PLUS:
+                syntax_error('unexpected ' + TOKEN_NAMES[type], token)
+        elif type in PRECEDENCE:
+            precedence = PRECEDENCE[type]
+            while stack and stack[-1][0] >= precedence: #左にある同じか強い演算子を先に計算する
+                _, arity, function = stack.pop()
+                rpn.append((arity, function))
+            stack.append((precedence, 2, BINARY_OPERATORS[type]))
+            expect_operand = True
+        elif type == CLOSE_PAREN or type == END:
+            while stack and stack[-1][0] > OPEN:
+                _, arity, function = stack.pop()
+                rpn.append((arity, function))
+            if type == END:
+                if stack:
+                    syntax_error('missing )', token)
+                return rpn
+            if not stack:
+                syntax_error('unexpected )', token)
+            stack.pop() #（
+        else:
+            syntax_error('unexpected ' + TOKEN_NAMES[type], token)
+
 
-#（）内計算
-def evaluate_parentheses(tokens):
-    index = 0
-    while index < len(tokens):
-        if tokens[index]['type'] == 'OPEN_PAREN':
-            sub_tokens = []
-            paren_count = 1
-            index += 1
-            start_index = index
-            while index < len(tokens) and paren_count > 0:
-                if tokens[index]['type'] == 'OPEN_PAREN':
-                    paren_count += 1
-                elif tokens[index]['type'] == 'CLOSE_PAREN':
-                    paren_count -= 1
-                if paren_count > 0:
-                    sub_tokens.append(tokens[index])
-                index += 1
-            sub_tokens = evaluate_parentheses(sub_tokens)
-            sub_value = evaluate_tokens(sub_tokens)
-            tokens = tokens[:start_index-1] + [{'type': 'NUMBER', 'number': sub_value}] + tokens[index:]
-            index = start_index
-        index += 1
-    return tokens
-    
-    
-    
-def evaluate_tokens(tokens):
-    #step1：*と/を処理
-    index = 1
-
-    while index < len(tokens):
-        if tokens[index]['type'] == 'ASTERISK':
-            tokens[index - 1]['number'] *= tokens[index + 1]['number']
-            del tokens[index:index + 2] #計算済みを削除
-        elif tokens[index]['type'] == 'SLASH':
-            tokens[index - 1]['number'] /= tokens[index + 1]['number']
-            del tokens[index:index + 2] #計算済みを削除
+#RPNをスタックで計算する
+def evaluate_rpn(rpn):
+    stack = []
+    for arity, value in rpn:
+        if arity == 0:
+            stack.append(value)
+        elif arity == 1:
+            stack[-1] = value(stack[-1])
         else:
-            index += 1
+            right = stack.pop()
+            stack[-1] = value(stack[-1], right)
+    return stack[0]
+
 
-    # step2：*/がない式をもう一度頭から計算
-    index = 0
-    answer = 0
-
-    tokens.insert(0, {'type' : 'PLUS'}) #先頭にdummyの+
-
-    while index < len(tokens):
-        if tokens[index]['type'] == 'NUMBER':
-            if tokens[index - 1]['type'] == 'PLUS':
-                answer += tokens[index]['number']
-            elif tokens[index - 1]['type'] == 'MINUS':
-                answer -= tokens[index]['number']
-            else:
-                print('Invalid syntax1')
-                exit(1)
-        index += 1
-    return answer
-    
 def evaluate(tokens):
-    tokens = evaluate_parentheses(tokens)
-    return evaluate_tokens(tokens)
+    return evaluate_rpn(parse(tokens))
 
 
 def test(line):
@@ -161,13 +143,61 @@ def run_test():
     test("(2*(2+2)*4)")
     test("120/(6*(5-3))")
     test("2.0*(4+2*(6/(4-2.5)))")
+    test("-3+4")
+    test("2*-3")
+    test("-(1+2)*-(3-5)")
+    test("1 + 2 * 3")
+    test("1.234567890123456*3")
+    test("0.1+0.2")
     print("==== Test finished! ====\n")
 
-run_test()
 
-while True:
-    print('> ', end="")
-    line = input()
-    tokens = tokenize(line)
-    answer = evaluate(tokens)
-    print("answer = %f\n" % answer)
\ No newline at end of file
+#間違った式は何文字目が悪いかをCalculatorErrorで知らせる
+def error_test():
+    assert tokenize(" 12+3 ") == [(NUMBER, 12.0, 1), (PLUS, None, 3), (NUMBER, 3.0, 4), (END, None, 6)]
+    for line, position in (("1+$", 2), ("1+", 2), ("(1+2", 4), ("1+2)", 3), ("2*(3+)", 5), ("", 0)):
+        try:
+            evaluate(tokenize(line))
+        except CalculatorError as error:
+            assert error.position == position, (line, error.position)
+        else:
+            assert False, line
+    print("Error tests passed!")
+
+
+#何万トークンもある式でも時間がトークン数に比例するか
+def performance_test():
+    for count in (10000, 100000):
+        line = "+".join("%d*2-1" % i for i in range(count))
+        begin = time.time()
+        answer = evaluate(tokenize(line))
+        assert answer == sum(i * 2 - 1 for i in range(count))
+        print("%d tokens: %.3fs" % (count * 4 - 1, time.time() - begin))
+
+    #（）や-が何万も入れ子になっていても計算できる
+    depth = 100000
+    assert evaluate(tokenize("(" * depth + "1" + ")" * depth)) == 1
+    assert evaluate(tokenize("-" * depth + "2*3")) == 6
+    assert evaluate(tokenize("2" + "*(1" * depth + ")" * depth)) == 2
+    print("%d nested parentheses: OK" % depth)
+
+
+if __name__ == "__main__":
+    run_test()
+    error_test()
+    performance_test()
+
+    while True:
+        print('> ', end="")
+        line = input()
+        try:
+            answer = evaluate(tokenize(line))
+        except CalculatorError as error:
+            print(error)
+            if error.position is not None:
+                print("  " + line + "\n  " + " " * error.position + "^\n")
+            continue
+        except ZeroDivisionError:
+            print("Division by zero\n")
+            continue
+        print("answer = %f\n" % answer)
\ No newline at end of file
@@ -1,175 +1,270 @@
 #! /usr/bin/python3
 #　absやintに対応できるように改良
 
-def read_number(line, index):
-    number = 0
-    while index < len(line) and line[index].isdigit():
-        number = number * 10 + int(line[index])
-        index += 1
-    if index < len(line) and line[index] == '.':
-        index += 1
-        decimal = 0.1
-        while index < len(line) and line[index].isdigit():
-            number += int(line[index]) * decimal
-            decimal /= 10
-            index += 1
-    token = {'type': 'NUMBER', 'number': number}
-    return token, index
+import collections, operator, re, time
 
-def read_function(line, index):
-    func_name = ''
-    while index < len(line) and line[index].isalpha():
-        func_name += line[index]
-        index += 1
-    token = {'type': 'FUNCTION', 'name': func_name}
-    return token, index
+try:
+    import numpy as np
+except ImportError: #numpyがなければevaluate_batchは1行ずつ計算する
+    np = None
 
+#式の間違いを，lineの何文字目か（position）と一緒に知らせる
+class CalculatorError(Exception):
 
-def read_plus(line, index):
-    token = {'type': 'PLUS'}
-    return token, index + 1
+    def __init__(self, message, position=None):
+        super().__init__(message if position is None else "%s (at %d)" % (message, position))
+        self.position = position
 
 
-def read_minus(line, index):
-    token = {'type': 'MINUS'}
-    return token, index + 1
+#トークンは (種類, 値, 何文字目か) のタプル。種類は整数
+NUMBER, NAME, PLUS, MINUS, ASTERISK, SLASH, OPEN_PAREN, CLOSE_PAREN, END = range(9)
+TOKEN_NAMES = ['number', 'name', '+', '-', '*', '/', '(', ')', 'end']
 
+#全部のトークンを一つの正規表現にまとめる。何番目のグループが一致したか(lastindex)が種類になる
+#関数名・変数名は2文字目から数字と_も使える
+TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+      (\d+(?:\.\d*)?)          # NUMBER
+    | ([A-Za-z_][A-Za-z0-9_]*) # NAME
+    | (\+) | (-) | (\*) | (/) | (\() | (\))
+    )""", re.VERBOSE)
+SPACE_PATTERN = re.compile(r"\s*")
 
-def read_asterisk(line, index):
-    token = {'type': 'ASTERISK'}
-    return token, index + 1
 
+#最後に (END, None, len(line)) を付ける（構文解析で範囲外を調べなくてよくなる）
+def tokenize(line):
+    tokens = []
+    index = 0
+    length = len(line)
+    match = TOKEN_PATTERN.match
+    while True:
+        m = match(line, index)
+        if m is None:
+            index = SPACE_PATTERN.match(line, index).end()
+            if index == length:
+                break
+            raise CalculatorError("Invalid character found: " + line[index], index)
+        type = m.lastindex - 1
+        if type == NUMBER:
+            tokens.append((NUMBER, float(m.group(1)), m.start(1)))
+        elif type == NAME:
+            tokens.append((NAME, m.group(2), m.start(2)))
+        else:
+            tokens.append((type, None, m.start(type + 1)))
+        index = m.end()
+    tokens.append((END, None, length))
+    return tokens
 
-def read_slash(line, index):
-    token = {'type': 'SLASH'}
-    return token, index + 1
 
-def read_open_paren(line, index):
-    token = {'type': 'OPEN_PAREN'}
-    return token, index + 1
+#構文解析: 演算子と（をスタックに積んでおく操車場アルゴリズム（shunting-yard）
+#トークンを前から1回読むだけで逆ポーランド記法(RPN)の列を作る
+#RPNの要素は (0, 数) か (1, 1項の関数) か (2, 2項の関数) か (3, 変数名)
+#（）や-がいくつ入れ子になっても，Pythonの関数の再帰ではなくstackの長さが伸びるだけ
+#stackの要素は (優先順位, arity, 関数)。（ は優先順位OPEN，abs(などの関数はCALLで，その（の一つ下に積む
+PRECEDENCE = {PLUS: 1, MINUS: 1, ASTERISK: 2, SLASH: 2}
+UNARY_PRECEDENCE = 3 #-xは*や/より先に計算する
+OPEN = 0
+CALL = -1
+BINARY_OPERATORS = {PLUS: operator.add, MINUS: operator.sub,
+                    ASTERISK: operator.mul, SLASH: operator.truediv}
+FUNCTIONS = {'abs': abs, 'int': int, 'round': round}
 
-def read_close_paren(line, index):
-    token = {'type': 'CLOSE_PAREN'}
-    return token, index + 1
 
+def syntax_error(message, token):
+    raise CalculatorError('Invalid syntax: ' + message, token[2])
 
-def tokenize(line):
-    tokens = []
-    index = 0
 
-    while index < len(line):
-
-        if line[index].isdigit():
-            (token, index) = read_number(line, index)
-        elif line[index].isalpha():
-            (token, index) = read_function(line, index)
-        elif line[index] == '+':
-            (token, index) = read_plus(line, index)
-        elif line[index] == '-':
-            (token, index) = read_minus(line, index)
-        elif line[index] == '*':
-            (token, index) = read_asterisk(line, index)
-        elif line[index] == '/':
-            (token, index) = read_slash(line, index)
-        elif line[index] == '(':
-            (token, index) = read_open_paren(line, index)
-        elif line[index] == ')':
-            (token, index) = read_close_paren(line, index)
+def parse(tokens):
+    rpn = []
+    stack = []
+    expect_operand = True #次に来るのは数・変数・関数・（・-のどれか
+    for index, token in enumerate(tokens):
+        type, value, _ = token
+        if expect_operand:
+            if type == NUMBER:
+                rpn.append((0, value))
+                expect_operand = False
+            elif type == NAME:
+                if tokens[index + 1][0] != OPEN_PAREN: #(がなければ変数
+                    rpn.append((3, value))
+                    expect_operand = False
+                elif value not in FUNCTIONS:
+                    syntax_error('unknown function ' + value, token)
+                else:
+                    stack.append((CALL, 1, FUNCTIONS[value])) #引数の)まで来たら計算する
+            elif type == MINUS: #後ろの数を符号反転
+                stack.append((UNARY_PRECEDENCE, 1, operator.neg))
+            elif type == OPEN_PAREN:
+                stack.append((OPEN, 0, None))
+            elif type != PLUS:
+                syntax_error('unexpected ' + TOKEN_NAMES[type], token)
+        elif type in PRECEDENCE:
+            precedence = PRECEDENCE[type]
+            while stack and stack[-1][0] >= precedence: #左にある同じか強い演算子を先に計算する
+                _, arity, function = stack.pop()
+                rpn.append((arity, function))
+            stack.append((precedence, 2, BINARY_OPERATORS[type]))
+            expect_operand = True
+        elif type == CLOSE_PAREN or type == END:
+            while stack and stack[-1][0] > OPEN:
+                _, arity, function = stack.pop()
+                rpn.append((arity, function))
+            if type == END:
+                if stack:
+                    syntax_error('missing )', token)
+                return rpn
+            if not stack:
+                syntax_error('unexpected )', token)
+            stack.pop() #（
+            if stack and stack[-1][0] == CALL:
+                _, arity, function = stack.pop()
+                rpn.append((arity, function))
         else:
-            print('Invalid character found: ' + line[index])
-            exit(1)
-        tokens.append(token)
-    return tokens
+            syntax_error('unexpected ' + TOKEN_NAMES[type], token)
 
 
-def evaluate(tokens):
-
-    def evaluate_function(tokens):
-        index = 0
-        while index < len(tokens):
-            if tokens[index]['type'] == 'FUNCTION':
-                func_name = tokens[index]['name']
-                
-                if func_name == 'abs':
-                    result = abs(tokens[index+1]['number'])
-                elif func_name == 'int':
-                    result = int(tokens[index+1]['number'])
-                elif func_name == 'round':
-                    result = round(tokens[index+1]['number'])
-                else:
-                    index += 1
-                    continue
-                tokens[index] = {'type': 'NUMBER', 'number': result}
-                del tokens[index+1]
-                    
-                
-            index += 1
-        return tokens
-    
-    
-        
-
-    #（）内計算
-    def evaluate_parentheses(tokens):
-        index = 0
-        while index < len(tokens):
-            if tokens[index]['type'] == 'OPEN_PAREN':
-                sub_tokens = []
-                paren_count = 1
-                index += 1
-                start_index = index
-                while index < len(tokens) and paren_count > 0:
-                    if tokens[index]['type'] == 'OPEN_PAREN':
-                        paren_count += 1
-                    elif tokens[index]['type'] == 'CLOSE_PAREN':
-                        paren_count -= 1
-                    if paren_count > 0:
-                        sub_tokens.append(tokens[index])
-                    index += 1
-                sub_tokens = evaluate_parentheses(sub_tokens)
-                sub_value = evaluate_tokens(sub_tokens)
-                tokens = tokens[:start_index-1] + [{'type': 'NUMBER', 'number': sub_value}] + tokens[index:]
-                index = start_index
-            index += 1
-        return tokens
-    
-    
-    
-    def evaluate_tokens(tokens):
-        #step1：*と/を処理
-        index = 1
-
-        while index < len(tokens):
-            if tokens[index]['type'] == 'ASTERISK':
-                tokens[index - 1]['number'] *= tokens[index + 1]['number']
-                del tokens[index:index + 2] #計算済みを削除
-            elif tokens[index]['type'] == 'SLASH':
-                tokens[index - 1]['number'] /= tokens[index + 1]['number']
-                del tokens[index:index + 2] #計算済みを削除
+def undefined_variable(name):
+    raise CalculatorError('Undefined variable: ' + name)
+
+
+#RPNをスタックで計算する。変数の値はvariablesから取る
+#functionsを渡すと関数を置き換える（evaluate_batchでnumpyの関数にするため）
+def evaluate_rpn(rpn, variables={}, functions=None):
+    stack = []
+    for arity, value in rpn:
+        if arity == 0:
+            stack.append(value)
+        elif arity == 1:
+            stack[-1] = (functions.get(value, value) if functions else value)(stack[-1])
+        elif arity == 2:
+            right = stack.pop()
+            stack[-1] = value(stack[-1], right)
+        else:
+            if value not in variables:
+                undefined_variable(value)
+            stack.append(variables[value])
+    return stack[0]
+
+
+def evaluate(tokens, variables={}):
+    return evaluate_rpn(parse(tokens), variables)
+
+
+#一度解析した式を，呼ぶだけで計算できる関数（クロージャ）にしておく
+#  数 -> lambda: 数，演算子 -> lambda: f(左(), 右()) を組み合わせる（トークンの辞書もRPNも見ない）
+#  変数のない部分はコンパイルするときに計算してしまう（2*3+x なら 6+x になる）
+#  返す関数は変数の辞書を引数に取る: compile("x*2")({'x': 3})
+#  木の深さがMAX_CLOSURE_DEPTHを超える長い式は，クロージャの呼び出しが深くなりすぎるのでRPNのまま計算する
+MAX_CLOSURE_DEPTH = 100
+COMPILE_CACHE_SIZE = 4096 #覚えておく式の数
+
+
+def constant(number):
+    return lambda variables={}: number
+
+
+def lookup(name):
+    def closure(variables={}):
+        if name not in variables:
+            undefined_variable(name)
+        return variables[name]
+    return closure
+
+
+def build_closure(rpn):
+    stack = [] #(クロージャ, 深さ, 変数を含まない値（含むならNone）)
+    for arity, value in rpn:
+        if arity == 0:
+            closure, depth, folded = constant(value), 1, value
+        elif arity == 3:
+            closure, depth, folded = lookup(value), 1, None
+        elif arity == 1:
+            operand, depth, folded = stack.pop()
+            if folded is not None:
+                folded = value(folded)
+                closure, depth = constant(folded), 1
             else:
-                index += 1
+                closure = lambda variables={}, f=value, a=operand: f(a(variables))
+                depth += 1
+        else:
+            right, right_depth, right_folded = stack.pop()
+            left, left_depth, left_folded = stack.pop()
+            if left_folded is not None and right_folded is not None:
+                folded = value(left_folded, right_folded)
+                closure, depth = constant(folded), 1
+            else:
+                closure = lambda variables={}, f=value, a=left, b=right: f(a(variables), b(variables))
+                depth, folded = max(left_depth, right_depth) + 1, None
+        if depth > MAX_CLOSURE_DEPTH:
+            return lambda variables={}: evaluate_rpn(rpn, variables)
+        stack.append((closure, depth, folded))
+    return stack[0][0]
 
-        # step2：*/がない式をもう一度頭から計算
-        index = 0
-        answer = 0
 
-        tokens.insert(0, {'type' : 'PLUS'}) #先頭にdummyの+
+#evaluate_batchで使う関数。int()は0の方へ切り捨て，round()は偶数への丸めなのでtrunc/rintと同じ値になる
+if np is not None:
+    ARRAY_FUNCTIONS = {abs: np.abs, int: np.trunc, round: np.rint}
 
-        while index < len(tokens):
-            if tokens[index]['type'] == 'NUMBER':
-                if tokens[index - 1]['type'] == 'PLUS':
-                    answer += tokens[index]['number']
-                elif tokens[index - 1]['type'] == 'MINUS':
-                    answer -= tokens[index]['number']
-                else:
-                    print('Invalid syntax1')
-                    exit(1)
-            index += 1
-        return answer
-    
-    tokens = evaluate_parentheses(tokens) #（）、関数名ある状態でOK。（）外す
-    tokens = evaluate_function(tokens)#関数名外される
-    return evaluate_tokens(tokens) #数字と符号のみ
+
+def build_batch(rpn):
+    if np is None:
+        closure = build_closure(rpn)
+        def evaluate_rows(columns):
+            names = list(columns)
+            return [closure(dict(zip(names, row))) for row in zip(*columns.values())]
+        return evaluate_rows
+    def evaluate_columns(columns):
+        columns = {name: np.asarray(column) for name, column in columns.items()}
+        result = evaluate_rpn(rpn, columns, ARRAY_FUNCTIONS)
+        if columns and np.ndim(result) == 0: #変数を使わない式でも行の数だけ返す
+            result = np.full(len(next(iter(columns.values()))), result)
+        return result
+    return evaluate_columns
+
+
+#式の文字列 -> コンパイルした関数 のLRUキャッシュ（一番古く使ったものから捨てる）
+class CompileCache:
+
+    #build: RPNから計算する関数を作る関数
+    def __init__(self, max_size=COMPILE_CACHE_SIZE, build=build_closure):
+        self.max_size = max_size
+        self.build = build
+        self.compiled = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, line):
+        compiled = self.compiled.get(line)
+        if compiled is not None:
+            self.hits += 1
+            self.compiled.move_to_end(line)
+            return compiled
+        self.misses += 1
+        compiled = self.build(parse(tokenize(line)))
+        self.compiled[line] = compiled
+        if len(self.compiled) > self.max_size:
+            self.compiled.popitem(last=False)
+            self.evictions += 1
+        return compiled
+
+    def stats(self):
+        return {'size': len(self.compiled), 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+compile_cache = CompileCache()
+batch_cache = CompileCache(build=build_batch)
+
+
+#lineを計算する関数を返す。同じ文字列なら2回目からはトークン化も解析もしない
+def compile(line, cache=compile_cache):
+    return cache.get(line)
+
+
+#列の辞書 {"x": 配列, ...} に対して式をまとめて計算する（numpyの配列の演算なので1行ずつのループがない）
+def evaluate_batch(line, columns, cache=batch_cache):
+    return cache.get(line)(columns)
 
 
 def test(line):
@@ -196,14 +291,134 @@ def run_test():
     test("abs(2+2)")
     test("int(1.55)")
     test("round(1.55)")
-    #test("12 + abs(2+2)")
+    test("12 + abs(2+2)")
+    test("abs(-3)*2")
+    test("abs(int(2.5)-round(4.4)*2)")
+    test("-int(-(1.5+1))")
+    test("2*(round(2.6)+abs(1-4))/3")
+    test("1.234567890123456*3")
+    test("0.1+0.2")
     print("==== Test finished! ====\n")
 
-run_test()
 
-while True:
-    print('> ', end="")
-    line = input()
-    tokens = tokenize(line)
-    answer = evaluate(tokens)
-    print("answer = %f\n" % answer)
\ No newline at end of file
+#間違った式は何文字目が悪いかをCalculatorErrorで知らせる
+def error_test():
+    assert tokenize(" 12+x_1 ") == [(NUMBER, 12.0, 1), (PLUS, None, 3), (NAME, 'x_1', 4), (END, None, 8)]
+    for line, position in (("1+$", 2), ("1+", 2), ("(1+2", 4), ("1+2)", 3), ("foo(1)", 0),
+                           ("abs 1", 4), ("2*(3+)", 5), ("", 0)):
+        try:
+            evaluate(tokenize(line))
+        except CalculatorError as error:
+            assert error.position == position, (line, error.position)
+        else:
+            assert False, line
+    try:
+        compile("x+1")()
+    except CalculatorError as error:
+        assert error.position is None and str(error) == "Undefined variable: x"
+    else:
+        assert False
+    print("Error tests passed!")
+
+
+def compile_test():
+    cache = CompileCache(max_size=2)
+    first = compile("1+2*3", cache)
+    assert first() == 7
+    assert compile("1+2*3", cache) is first
+    assert compile("abs(-2)", cache)() == 2
+    assert compile("round(2.6)-1", cache)() == 2 #1+2*3 が捨てられる
+    assert compile("1+2*3", cache) is not first
+    assert cache.stats() == {'size': 2, 'hits': 1, 'misses': 4, 'evictions': 2}
+    line = "-".join(["1"] * 1000) #深い式はRPNのまま計算する
+    assert compile(line, cache)() == 1 - 999
+    assert compile("x-" + line, cache)({'x': 1}) == 1 - 1000
+    print("Compile tests passed!")
+
+
+def variable_test():
+    variables = {'x': 3, 'y': -2.5, 'rate_2': 0.5}
+    for line in ("x*2+abs(y)", "-x/(y+1)", "round(x*rate_2)+int(y)", "2*3+x", "x"):
+        expected = eval(line, {}, dict(variables))
+        assert abs(evaluate(tokenize(line), variables) - expected) < 1e-8, line
+        assert abs(compile(line)(variables) - expected) < 1e-8, line
+
+    if np is not None:
+        rng = np.random.default_rng(0)
+        columns = {'x': rng.uniform(-10, 10, 1000), 'y': rng.integers(-5, 5, 1000).astype(float)}
+        columns['x'][:4] = [0.5, 1.5, 2.5, -2.5] #偶数への丸め
+        for line in ("x*2+abs(y)", "round(x)-int(x/3)", "-(x+y)*abs(round(y/2))", "1+2"):
+            actual = evaluate_batch(line, columns)
+            expected = [compile(line)({'x': x, 'y': y}) for x, y in zip(columns['x'], columns['y'])]
+            assert actual.shape == (1000,) and np.allclose(actual, expected), line
+    print("Variable tests passed!")
+
+
+#何万トークンもある式でも時間がトークン数に比例するか
+def performance_test():
+    for count in (10000, 100000):
+        line = "+".join("abs(%d*2-1)" % i for i in range(count))
+        begin = time.time()
+        tokens = tokenize(line)
+        tokenized = time.time() - begin
+        answer = evaluate(tokens)
+        assert answer == sum(abs(i * 2 - 1) for i in range(count))
+        print("%d tokens: %.3fs (tokenize %.3fs)" % (count * 7 - 1, time.time() - begin, tokenized))
+
+    #（）や-が何万も入れ子になっていても計算できる
+    depth = 100000
+    assert evaluate(tokenize("(" * depth + "1" + ")" * depth)) == 1
+    assert evaluate(tokenize("-" * depth + "2*3")) == 6
+    assert evaluate(tokenize("2" + "*(1" * depth + ")" * depth)) == 2
+    assert evaluate(tokenize("abs(-" * depth + "1" + ")" * depth)) == 1
+    print("%d nested parentheses: OK" % depth)
+
+    #同じ式を何度も計算するときのキャッシュの効果
+    lines = ["%d*abs(%d-%d)+round(%d/7)" % (i, i, i * 3, i) for i in range(1000)]
+    begin = time.time()
+    for _ in range(100):
+        for line in lines:
+            evaluate(tokenize(line))
+    uncached = time.time() - begin
+    begin = time.time()
+    for _ in range(100):
+        for line in lines:
+            compile(line)()
+    print("100000 evaluations: %.3fs, compiled: %.3fs %s" % (
+        uncached, time.time() - begin, compile_cache.stats()))
+
+    #変数のある式を何百万行に対して計算する
+    if np is not None:
+        line = "x*2+abs(y)-round(x/3)"
+        columns = {'x': np.arange(1000000) / 7, 'y': np.arange(1000000) % 13 - 6.0}
+        begin = time.time()
+        evaluate_batch(line, columns)
+        batch = time.time() - begin
+        compiled = compile(line)
+        begin = time.time()
+        for x, y in zip(columns['x'][:100000].tolist(), columns['y'][:100000].tolist()):
+            compiled({'x': x, 'y': y})
+        print("1000000 rows batch: %.3fs, 100000 rows one by one: %.3fs" % (batch, time.time() - begin))
+
+
+if __name__ == "__main__":
+    run_test()
+    error_test()
+    compile_test()
+    variable_test()
+    performance_test()
+
+    while True:
+        print('> ', end="")
+        line = input()
+        try:
+            answer = compile(line)()
+        except CalculatorError as error:
+            print(error)
+            if error.position is not None:
+                print("  " + line + "\n  " + " " * error.position + "^\n")
+            continue
+        except ZeroDivisionError:
+            print("Division by zero\n")
+            continue
+        print("answer = %f\n" % answer)
\ No newline at end of file